@@ -0,0 +1,468 @@
+import sys
+import time
+import pickle
+import numpy as np
+from skimage.filters import threshold_multiotsu
+from functions2 import *
+from dataset import Dataset
+from metrics import ROIDetectionEvaluation, DetectionMeasurements
+
+
+def RunPipeline(datapaths, prepipeline, detector, roipooling, topk, estimator = None):
+    """running the preprocessing, the detector and (optionally) the estimator frame by frame
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        prepipeline (PrePipeline): the preprocessing pipeline
+        detector (TrackingDetectingMergeProcess): the detector
+        roipooling (ROIPooling): the ROI pooling of the estimator input
+        topk (int): the number of pooled temperatures in the estimator input
+        estimator (optional): a trained estimator (e.g. Models/hgbr_range2.sav). Defaults to None.
+
+    Returns:
+        dictionary: the valid bounding boxes, the estimator inputs and predictions of every frame, the detection results and the running time.
+    """
+    dataset = Dataset(datapaths)
+    results = {'valid_BBoxes': [], 'features': [], 'predictions': [], 'TP': 0, 'FP': 0, 'FN': 0, 'time': 0.0}
+    for index in range(dataset.len()):
+        ira_matrix, ambient_temperature, timestamps, GT_bbox, GT_depth, GT_range = dataset.GetSample(index)
+        start = time.time()
+        ira_img, subpage_type, ira_mat = prepipeline.Forward(ira_matrix, ambient_temperature)
+        if not isinstance(ira_img, (np.ndarray)):
+            continue
+        _, _, _, _, _, _, valid_BBoxes, valid_timers, _ = detector.Forward(ira_img)
+        features = []
+        for (x, y, w, h) in valid_BBoxes:
+            if w == 0:
+                features.append(None)
+                continue
+            pooled_roi = roipooling.PoolingNumpy(ira_mat[int(y):int(y+h), int(x):int(x+w)])
+            sorted_roi = np.sort(np.reshape(pooled_roi, -1))[::-1]
+            features.append(np.concatenate((sorted_roi[:topk], [x+w/2, y+h/2])))
+        predictions = [None if f is None or estimator is None else estimator.predict(f.reshape(1, -1))[0] for f in features]
+        results['time'] += time.time() - start
+
+        (TP, FP, FN), _ = ROIDetectionEvaluation(GT_bbox, valid_BBoxes, valid_timers, threshold=0.5)
+        results['TP'] += TP
+        results['FP'] += FP
+        results['FN'] += FN
+        results['valid_BBoxes'].append(list(valid_BBoxes))
+        results['features'].append(features)
+        results['predictions'].append(predictions)
+    return results
+
+
+def CompareDtypes(datapaths, estimator_path = None, bbox_tolerance = 2, estimate_tolerance = 0.05):
+    """checking that the float32 pipeline stays within tolerance of the float64 pipeline
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        estimator_path (str, optional): the saved trained estimator that uses topk temperatures and the bbox center. Defaults to None.
+        bbox_tolerance (int, optional): the largest accepted difference of the bounding box coordinates (pixels). Defaults to 2.
+        estimate_tolerance (float, optional): the largest accepted difference of the estimates (meter). Defaults to 0.05.
+
+    Returns:
+        bool: whether the float32 pipeline is within tolerance.
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    roipooling = ROIPooling((200, 400), 100, 100)
+    topk = 8
+    estimator = pickle.load(open(estimator_path, 'rb')) if estimator_path is not None else None
+
+    results = {}
+    for dtype in [np.float64, np.float32]:
+        prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound, dtype=dtype)
+        detector = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit)
+        results[dtype] = RunPipeline(datapaths, prepipeline, detector, roipooling, topk, estimator)
+    r64 = results[np.float64]
+    r32 = results[np.float32]
+
+    identical_frames = 0
+    max_bbox_diff = 0
+    max_feature_diff = 0.0
+    max_estimate_diff = 0.0
+    for frame_index in range(len(r64['valid_BBoxes'])):
+        bboxes64 = r64['valid_BBoxes'][frame_index]
+        bboxes32 = r32['valid_BBoxes'][frame_index]
+        if bboxes64 == bboxes32:
+            identical_frames += 1
+        if len(bboxes64) != len(bboxes32):
+            max_bbox_diff = max(max_bbox_diff, np.inf)
+            continue
+        for i_box in range(len(bboxes64)):
+            max_bbox_diff = max(max_bbox_diff, np.max(np.abs(np.array(bboxes64[i_box]) - np.array(bboxes32[i_box]))))
+            if bboxes64[i_box] != bboxes32[i_box] or r64['features'][frame_index][i_box] is None:
+                continue
+            max_feature_diff = max(max_feature_diff, np.max(np.abs(r64['features'][frame_index][i_box] - r32['features'][frame_index][i_box])))
+            if estimator is not None:
+                max_estimate_diff = max(max_estimate_diff, abs(r64['predictions'][frame_index][i_box] - r32['predictions'][frame_index][i_box]))
+
+    print("frames with identical bboxes: ", identical_frames, "/", len(r64['valid_BBoxes']))
+    print("max bbox difference (pixel): ", max_bbox_diff)
+    print("max estimator input difference: ", max_feature_diff)
+    print("max estimate difference (meter): ", max_estimate_diff)
+    for dtype, r in [('float64', r64), ('float32', r32)]:
+        precision, recall, F1_score = DetectionMeasurements(r['TP'], r['FP'], r['FN'])
+        print(dtype, " F1_score: ", F1_score, " time: ", r['time'])
+    return max_bbox_diff <= bbox_tolerance and max_estimate_diff <= estimate_tolerance
+
+
+def SkimageMultiOtsu(hist, num_classes):
+    # the former DetectingProcess.MultiOtsu, which downsamples the histogram above 4 classes
+    if num_classes>4:
+        hist = (np.array(hist[0][::5]), np.array(hist[1][::5]))
+    return threshold_multiotsu(image=None, classes= num_classes, hist=hist)
+
+
+def BetweenClassVariance(hist, thresholds):
+    counts, bin_centers = hist
+    prob = counts / np.sum(counts)
+    classes = np.digitize(bin_centers, thresholds, right=True)
+    variance = 0.0
+    for c in range(len(thresholds) + 1):
+        weight = np.sum(prob[classes == c])
+        if weight > 0:
+            variance += np.sum(prob[classes == c] * bin_centers[classes == c])**2 / weight
+    return variance
+
+
+def BenchmarkMultiOtsu(datapaths):
+    """comparing MultiOtsuThresholds with the skimage path on the column histograms of the detected regions
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+
+    Returns:
+        dictionary: per number of classes, the number of histograms, the identical thresholds, the running times and the
+        relative gain of the between-class variance (computed at the full resolution).
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    dataset = Dataset(datapaths)
+    prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
+    detector = DetectingProcess(expansion_coefficient, valid_region_area_limit)
+    results = {}
+    for index in range(dataset.len()):
+        ira_matrix, ambient_temperature, _, _, _, _ = dataset.GetSample(index)
+        ira_img, _, _ = prepipeline.Forward(ira_matrix, ambient_temperature)
+        if not isinstance(ira_img, (np.ndarray)):
+            continue
+        regions, _ = detector.FindRegions(ira_img)
+        distributions, candidates = detector.RegionDistributions(ira_img, regions.Crops())
+        for (distri_x, bins_x, _), (peaks_x, _, _, _) in zip(distributions, candidates):
+            num_classes = len(peaks_x)
+            if num_classes < 2:
+                continue
+            hist = (distri_x, bins_x)
+            r = results.setdefault(num_classes, {'histograms': 0, 'identical': 0, 'skimage_time': 0.0, 'time': 0.0, 'variance_gain': []})
+            start = time.time()
+            thresholds_skimage = SkimageMultiOtsu(hist, num_classes)
+            r['skimage_time'] += time.time() - start
+            start = time.time()
+            thresholds = MultiOtsuThresholds(distri_x, bins_x, num_classes)
+            r['time'] += time.time() - start
+            r['histograms'] += 1
+            r['identical'] += np.array_equal(thresholds, thresholds_skimage)
+            variance_skimage = BetweenClassVariance(hist, thresholds_skimage)
+            r['variance_gain'].append((BetweenClassVariance(hist, thresholds) - variance_skimage) / variance_skimage)
+
+    print("classes  histograms  identical  skimage[ms]  multiotsu[ms]  variance gain (mean/max)")
+    for num_classes in sorted(results):
+        r = results[num_classes]
+        print("%7d %11d %10d %12.3f %14.3f %12.2e / %.2e" % (num_classes, r['histograms'], r['identical'],
+              r['skimage_time'] / r['histograms'] * 1000, r['time'] / r['histograms'] * 1000, np.mean(r['variance_gain']), np.max(r['variance_gain'])))
+    return results
+
+
+def IoU(mask1, mask2):
+    union = np.sum((mask1 > 0) | (mask2 > 0))
+    if union == 0:
+        return 1.0
+    return np.sum((mask1 > 0) & (mask2 > 0)) / union
+
+
+def CompareAdaptiveBinary(datapaths, threshold_downscales = (4, 10, 20)):
+    """the IoU agreement of the low resolution adaptive threshold with the full resolution one
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        threshold_downscales (tuple, optional): the downscale factors of the threshold surface. Defaults to (4, 10, 20).
+
+    Returns:
+        dictionary: per downscale factor, the IoUs of the binary masks and of the region masks (after the border and
+        blob removing) with the full resolution ones, and the running time of AdaptiveBinary.
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    dataset = Dataset(datapaths)
+    prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
+    detectors = {s: DetectingProcess(expansion_coefficient, valid_region_area_limit, threshold_downscale=s) for s in (1,) + tuple(threshold_downscales)}
+    box_size = (int(expansion_coefficient * expansion_coefficient * valid_region_area_limit)//2)*2 +1
+    results = {s: {'binary_IoU': [], 'region_IoU': [], 'time': 0.0} for s in detectors}
+    for index in range(dataset.len()):
+        ira_matrix, ambient_temperature, _, _, _, _ = dataset.GetSample(index)
+        ira_img, _, _ = prepipeline.Forward(ira_matrix, ambient_temperature)
+        if not isinstance(ira_img, (np.ndarray)):
+            continue
+        masks = {}
+        for s, detector in detectors.items():
+            start = time.time()
+            binary = detector.AdaptiveBinary(ira_img, 255, box_size)
+            results[s]['time'] += time.time() - start
+            _, region_mask = detector.FindRegions(ira_img)
+            masks[s] = (binary, region_mask)
+        for s in threshold_downscales:
+            results[s]['binary_IoU'].append(IoU(masks[1][0], masks[s][0]))
+            results[s]['region_IoU'].append(IoU(masks[1][1], masks[s][1]))
+
+    frames = max(len(results[threshold_downscales[0]]['binary_IoU']), 1)
+    print("full resolution AdaptiveBinary: %.3f ms" % (results[1]['time'] / frames * 1000))
+    print("downscale  binary IoU (mean/min)  region IoU (mean/min)  time[ms]")
+    for s in threshold_downscales:
+        r = results[s]
+        print("%9d %13.4f / %.4f %14.4f / %.4f %9.3f" % (s, np.mean(r['binary_IoU']), np.min(r['binary_IoU']),
+              np.mean(r['region_IoU']), np.min(r['region_IoU']), r['time'] / frames * 1000))
+    return results
+
+
+def BBoxIoU(bbox1, bbox2):
+    x1, y1 = max(bbox1[0], bbox2[0]), max(bbox1[1], bbox2[1])
+    x2, y2 = min(bbox1[0] + bbox1[2], bbox2[0] + bbox2[2]), min(bbox1[1] + bbox1[3], bbox2[1] + bbox2[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    return intersection / (bbox1[2] * bbox1[3] + bbox2[2] * bbox2[3] - intersection)
+
+
+def CompareCoarseToFine(datapaths, coarse_expansion_coefficients = (2, 4)):
+    """the agreement of the coarse-to-fine detection with the full resolution one
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        coarse_expansion_coefficients (tuple, optional): the coarse expansion ratios. Defaults to (2, 4).
+
+    Returns:
+        dictionary: per coarse expansion ratio, the number of frames with the same number of bboxes, the best IoU of
+        every full resolution bbox and the running time of DetectingProcess.Forward.
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    dataset = Dataset(datapaths)
+    prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
+    detectors = {None: DetectingProcess(expansion_coefficient, valid_region_area_limit)}
+    for c in coarse_expansion_coefficients:
+        detectors[c] = DetectingProcess(expansion_coefficient, valid_region_area_limit, coarse_expansion_coefficient=c)
+    results = {c: {'same_count': 0, 'bbox_IoU': [], 'time': 0.0} for c in detectors}
+    frames = 0
+    for index in range(dataset.len()):
+        ira_matrix, ambient_temperature, _, _, _, _ = dataset.GetSample(index)
+        ira_img, _, _ = prepipeline.Forward(ira_matrix, ambient_temperature)
+        if not isinstance(ira_img, (np.ndarray)):
+            continue
+        frames += 1
+        bboxes = {}
+        for c, detector in detectors.items():
+            start = time.time()
+            bboxes[c] = detector.Forward(ira_img)[3]
+            results[c]['time'] += time.time() - start
+        for c in coarse_expansion_coefficients:
+            results[c]['same_count'] += len(bboxes[c]) == len(bboxes[None])
+            results[c]['bbox_IoU'] += [max([BBoxIoU(b, b_) for b_ in bboxes[c]], default=0) for b in bboxes[None]]
+
+    frames = max(frames, 1)
+    print("full resolution Forward: %.3f ms" % (results[None]['time'] / frames * 1000))
+    print("coarse  same count  bbox IoU (mean/min)  time[ms]")
+    for c in coarse_expansion_coefficients:
+        r = results[c]
+        print("%6d %11.3f %11.4f / %.4f %9.3f" % (c, r['same_count'] / frames, np.mean(r['bbox_IoU']) if r['bbox_IoU'] else 1.0,
+              np.min(r['bbox_IoU']) if r['bbox_IoU'] else 1.0, r['time'] / frames * 1000))
+    return results
+
+
+def CompareTrackers(datapaths, tracker_backends = ("kcf", "bbox")):
+    """the speed and the detection F1 of the tracker backends of TrackingDetectingMergeProcess
+
+    The detection of every frame is computed once and shared by the backends, so the time is the one of the
+    tracking and merge pass.
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        tracker_backends (tuple, optional): the tracker backends. Defaults to ("kcf", "bbox").
+
+    Returns:
+        dictionary: per backend, the TP, FP and FN of ROIDetectionEvaluation, the F1 and the running time.
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    results = {b: {'TP': 0, 'FP': 0, 'FN': 0, 'time': 0.0} for b in tracker_backends}
+    detection_time = 0.0
+    frames = 0
+    for datapath in datapaths:
+        # every recording starts with new trackers
+        dataset = Dataset([datapath])
+        prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
+        detector = DetectingProcess(expansion_coefficient, valid_region_area_limit)
+        mergers = {b: TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit, tracker_backend=b) for b in tracker_backends}
+        for index in range(dataset.len()):
+            ira_matrix, ambient_temperature, _, GT_bbox, _, _ = dataset.GetSample(index)
+            ira_img, _, _ = prepipeline.Forward(ira_matrix, ambient_temperature)
+            if not isinstance(ira_img, (np.ndarray)):
+                continue
+            frames += 1
+            start = time.time()
+            detection = detector.Forward(ira_img)
+            detection_time += time.time() - start
+            for b, merger in mergers.items():
+                start = time.time()
+                _, _, _, _, _, _, valid_BBoxes, valid_timers, _ = merger.Forward(ira_img, detection=detection)
+                results[b]['time'] += time.time() - start
+                (TP, FP, FN), _ = ROIDetectionEvaluation(GT_bbox, valid_BBoxes, valid_timers, threshold=0.5)
+                results[b]['TP'] += TP
+                results[b]['FP'] += FP
+                results[b]['FN'] += FN
+
+    frames = max(frames, 1)
+    print("detection: %.3f ms" % (detection_time / frames * 1000))
+    print("backend  tracking[ms]  tracking fps  pipeline fps     F1")
+    for b in tracker_backends:
+        r = results[b]
+        r['F1'] = 2 * r['TP'] / max(2 * r['TP'] + r['FP'] + r['FN'], 1)
+        print("%7s %13.3f %13.1f %13.2f %8.4f" % (b, r['time'] / frames * 1000, frames / max(r['time'], 1e-9),
+              frames / max(r['time'] + detection_time, 1e-9), r['F1']))
+    return results
+
+
+def BenchmarkTrackerThreads(datapaths, thread_counts = (1, 2, 4, 8)):
+    """the scaling of the concurrent KCF updates with the number of threads
+
+    The detection of every frame is computed once and shared by the pipelines. The KCF update time is read from the
+    kcf_update stage of the instrumentation, which is reset on every frame.
+
+    Args:
+        datapaths (list): the recordings in the Dataset folder
+        thread_counts (tuple, optional): the numbers of threads of TrackingProcess. Defaults to (1, 2, 4, 8).
+
+    Returns:
+        dictionary: per number of threads, the KCF update time, the number of updated trackers and the number of
+        frames whose outputs are identical to the ones of the first number of threads.
+    """
+    expansion_coefficient = 20
+    temperature_upper_bound = 37
+    valid_region_area_limit = 5
+    results = {t: {'kcf_update': 0.0, 'trackers': 0, 'identical': 0} for t in thread_counts}
+    frames = 0
+    enabled = instrumentation.enabled
+    instrumentation.Enable()
+    for datapath in datapaths:
+        dataset = Dataset([datapath])
+        prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
+        detector = DetectingProcess(expansion_coefficient, valid_region_area_limit)
+        mergers = {t: TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit, tracker_threads=t) for t in thread_counts}
+        try:
+            for index in range(dataset.len()):
+                ira_matrix, ambient_temperature, _, _, _, _ = dataset.GetSample(index)
+                ira_img, _, _ = prepipeline.Forward(ira_matrix, ambient_temperature)
+                if not isinstance(ira_img, (np.ndarray)):
+                    continue
+                frames += 1
+                detection = detector.Forward(ira_img)
+                reference = None
+                for t, merger in mergers.items():
+                    results[t]['trackers'] += merger.tracker.GetTrackersNum()
+                    instrumentation.Reset()
+                    outputs = merger.Forward(ira_img, detection=detection)
+                    results[t]['kcf_update'] += sum(instrumentation.timings['kcf_update'])
+                    if reference is None:
+                        reference = outputs[6:9]
+                    results[t]['identical'] += outputs[6:9] == reference
+        finally:
+            for merger in mergers.values():
+                merger.Close()
+    instrumentation.Reset()
+    if not enabled:
+        instrumentation.Disable()
+
+    frames = max(frames, 1)
+    base = results[thread_counts[0]]['kcf_update']
+    print("frames: %d, trackers per frame: %.2f" % (frames, results[thread_counts[0]]['trackers'] / frames))
+    print("threads  kcf_update[ms]  speedup  identical")
+    for t in thread_counts:
+        r = results[t]
+        print("%7d %15.3f %8.2f %6d/%d" % (t, r['kcf_update'] / frames * 1000, base / max(r['kcf_update'], 1e-9), r['identical'], frames))
+    return results
+
+
+if __name__ == "__main__":
+    # python benchmark.py multiotsu runs the multi-Otsu benchmark on the multi-user recordings
+    if len(sys.argv) > 1 and sys.argv[1] == 'multiotsu':
+        datapaths = [
+            'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FiveUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FiveUser_Static_0_sensor_4.pickle',
+            'Dataset/FiveUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_3_sensor_4.pickle',
+        ]
+        BenchmarkMultiOtsu(datapaths)
+        sys.exit(0)
+    # python benchmark.py adaptivebinary reports the agreement of the low resolution adaptive threshold
+    if len(sys.argv) > 1 and sys.argv[1] == 'adaptivebinary':
+        datapaths = [
+            'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/Bathroom1_0_sensor_1.pickle',
+            'Dataset/Meetingroom_0_sensor_4.pickle',
+        ]
+        CompareAdaptiveBinary(datapaths)
+        sys.exit(0)
+    # python benchmark.py coarsetofine reports the agreement of the coarse-to-fine detection
+    if len(sys.argv) > 1 and sys.argv[1] == 'coarsetofine':
+        datapaths = [
+            'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/Bathroom1_0_sensor_1.pickle',
+        ]
+        CompareCoarseToFine(datapaths)
+        sys.exit(0)
+    # python benchmark.py trackers compares the KCF and the bbox only tracker on the multi-user recordings
+    if len(sys.argv) > 1 and sys.argv[1] == 'trackers':
+        datapaths = [
+            'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FiveUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FiveUser_Static_0_sensor_4.pickle',
+            'Dataset/FiveUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_3_sensor_4.pickle',
+        ]
+        CompareTrackers(datapaths)
+        sys.exit(0)
+    # python benchmark.py trackerthreads reports the scaling of the concurrent KCF updates on the multi-user recordings
+    if len(sys.argv) > 1 and sys.argv[1] == 'trackerthreads':
+        datapaths = [
+            'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FiveUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FiveUser_Static_0_sensor_4.pickle',
+            'Dataset/FiveUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+            'Dataset/FourUser_Dynamic_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_1_sensor_4.pickle',
+            'Dataset/FourUser_Static_3_sensor_4.pickle',
+        ]
+        BenchmarkTrackerThreads(datapaths)
+        sys.exit(0)
+    datapaths = [
+        'Dataset/FiveUser_Dynamic_0_sensor_4.pickle',
+        'Dataset/FourUser_Dynamic_0_sensor_4.pickle',
+        'Dataset/Bathroom1_0_sensor_1.pickle',
+    ]
+    within_tolerance = CompareDtypes(datapaths, estimator_path='Models/hgbr_range2.sav')
+    print("float32 pipeline within tolerance: ", within_tolerance)
+    sys.exit(0 if within_tolerance else 1)
@@ -36,6 +36,9 @@ class Dataset():
     def GetSample(self, index):
         return self.ira_matrix[index], self.ambient_temperature[index], self.timestamps[index], self.GT_bbox[index], self.GT_depth[index], self.GT_range[index]
     
+    def GetBatch(self, start, end):
+        return np.array(self.ira_matrix[start:end]), np.array(self.ambient_temperature[start:end])
+    
     def GetAllSamples(self):
         return self.ira_matrix, self.ambient_temperature, self.timestamps, self.GT_bbox, self.GT_depth, self.GT_range
     
@@ -9,11 +9,23 @@ from skimage.measure import label,regionprops
 from scipy import ndimage as ndi
 from tqdm import tqdm
 import ast
-import numba as nb
+import time
+import atexit
+import copy
+import functools
+import concurrent.futures
+from collections import defaultdict, namedtuple
+try:
+    import numba as nb
+except ImportError:     # numba is optional, the NumPy implementations are used without it
+    nb = None
 from skimage.filters import threshold_multiotsu
 from scipy import signal
-import torch.nn as nn
-import torch
+from scipy.optimize import linear_sum_assignment
+try:
+    from filterpy.kalman import KalmanFilter
+except ImportError:
+    KalmanFilter = None
 from sklearn.kernel_ridge import KernelRidge
 from sklearn.svm import SVR
 from sklearn import neighbors
@@ -22,6 +34,101 @@ from sklearn.ensemble import AdaBoostRegressor, HistGradientBoostingRegressor, G
 
 
 
+############ Instrumentation of the pipeline
+class StageTimer():
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.Record(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Instrumentation():
+    """Per-stage wall time and counters of the processing pipeline.
+
+    The pipeline reports to the module-level `instrumentation` object, e.g. `with instrumentation.Stage("kcf_update"): ...`
+    and `instrumentation.Count("trackers_created")`. It is disabled by default, in which case a stage costs one attribute
+    check. Other sinks (loggers, dashboards) can be plugged in with AddListener.
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.listeners = []
+        self.null_stage = NullStage()
+        self.Reset()
+
+    def Enable(self):
+        self.enabled = True
+
+    def Disable(self):
+        self.enabled = False
+
+    def Reset(self):
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    def AddListener(self, listener):
+        # listener(kind, name, value) is called for every record, kind is "time" (value in seconds) or "count".
+        self.listeners.append(listener)
+
+    def Stage(self, name):
+        if not self.enabled:
+            return self.null_stage
+        return StageTimer(self, name)
+
+    def Record(self, name, duration):
+        if not self.enabled:
+            return
+        self.timings[name].append(duration)
+        for listener in self.listeners:
+            listener("time", name, duration)
+
+    def Count(self, name, n = 1):
+        if not self.enabled:
+            return
+        self.counters[name] += n
+        for listener in self.listeners:
+            listener("count", name, n)
+
+    def Histogram(self, name, bins = None):
+        # wall time histogram of a stage, the default bins are log-spaced from 10us to 10s.
+        if bins is None:
+            bins = np.logspace(-5, 1, 13)
+        return np.histogram(self.timings[name], bins=bins)
+
+    def Summary(self):
+        lines = ["%-22s %8s %10s %10s %10s %10s %10s" % ("stage", "calls", "total[s]", "mean[ms]", "p50[ms]", "p90[ms]", "max[ms]")]
+        for name, durations in self.timings.items():
+            d = np.array(durations) * 1000
+            lines.append("%-22s %8d %10.3f %10.3f %10.3f %10.3f %10.3f" % (name, len(d), d.sum()/1000, d.mean(), np.percentile(d, 50), np.percentile(d, 90), d.max()))
+        for name, n in self.counters.items():
+            lines.append("%-22s %8d" % (name, n))
+        return "\n".join(lines)
+
+    def DumpAtExit(self, file = None):
+        # printing the summary (or writing it into file) when the program exits.
+        def dump():
+            if file is None:
+                print(self.Summary())
+            else:
+                with open(file, 'w') as f:
+                    f.write(self.Summary() + "\n")
+        atexit.register(dump)
+
+instrumentation = Instrumentation()
+
+
 # zone map only support the MLX90640-110 sensor
 def GetZoneMap():
     zones_map = np.zeros((24, 32))
@@ -48,46 +155,73 @@ def GetChessboard(shape):
     return chessboard, chessboard_inverse
 
 # Checking the type of the subpage.
+# Works on a single subpage (24,32) as well as on a stack of subpages (N,24,32).
 def SubpageType(mat, chessboard):
-        subpage0 = mat * chessboard
-        if np.sum(subpage0) < 1:
-            return 1
-        return 0
+        subpage0_sum = np.sum(mat * chessboard, axis=(-2, -1))
+        subpage_type = np.where(subpage0_sum < 1, 1, 0)
+        if np.ndim(mat) == 2:
+            return int(subpage_type)
+        return subpage_type
+
+# Average of the valid neighbours of every pixel, the neighbours are given as (row, col) offsets.
+# As the indexing of the original loops, a -1 offset at the top/left border wraps around to the opposite edge,
+# while a +1 offset beyond the bottom/right border is not counted. Invalid neighbours are not counted either,
+# pixels without any valid neighbour get 0.
+# Works on a single frame (H,W) as well as on a stack of frames (N,H,W).
+NEIGHBOURS_CROSS = ((-1, 0), (1, 0), (0, -1), (0, 1))          # top, down, left, right
+NEIGHBOURS_DIAGONAL = ((-1, -1), (1, -1), (-1, 1), (1, 1))     # topleft, bottomleft, topright, bottomright
+def NeighbourAverage(mat, valid, neighbours):
+    H, W = mat.shape[-2:]
+    wrap_width = [(0, 0)] * (mat.ndim - 2) + [(1, 0), (1, 0)]
+    pad_width = [(0, 0)] * (mat.ndim - 2) + [(0, 1), (0, 1)]
+    values = np.pad(np.pad(np.where(valid, mat, 0.0), wrap_width, mode="wrap"), pad_width)
+    counts = np.pad(np.pad(valid, wrap_width, mode="wrap"), pad_width).astype(np.int8)
+    neighbour_sum = 0.0
+    neighbour_num = 0
+    for di, dj in neighbours:
+        neighbour_sum = neighbour_sum + values[..., 1+di:1+di+H, 1+dj:1+dj+W]
+        neighbour_num = neighbour_num + counts[..., 1+di:1+di+H, 1+dj:1+dj+W]
+    return np.divide(neighbour_sum, neighbour_num, out=np.zeros_like(neighbour_sum), where=neighbour_num > 0)
 
 # Interpolating the subpage into a complete frame by using the bilinear interpolating method with window size at 3x3.
+# Every missing pixel (value <= 0) is replaced by the mean of its valid 4-neighbours (top, down, left, right).
+# Works on a single frame (24,32) as well as on a stack of frames (N,24,32).
 def SubpageInterpolating(subpage):
-    shape = subpage.shape
-    mat = subpage.copy()
-    for i in range(shape[0]):
-        for j in range(shape[1]):
-            if mat[i,j] > 0.0:
-                continue
-            num = 0
-            try:
-                top = mat[i-1,j]
-                num = num+1
-            except:
-                top = 0.0
-            
-            try:
-                down = mat[i+1,j]
-                num = num+1
-            except:
-                down = 0.0
-            
-            try:
-                left = mat[i,j-1]
-                num = num+1
-            except:
-                left = 0.0
-            
-            try:
-                right = mat[i,j+1]
-                num = num+1
-            except:
-                right = 0.0
-            mat[i,j] = (top + down + left + right)/num
-    return mat
+    mat = np.array(subpage)
+    valid = mat > 0.0
+    filled = NeighbourAverage(mat, valid, NEIGHBOURS_CROSS)
+    return np.where(valid, mat, filled)
+
+
+# BandPass, Normalize and ChangeScale of BaseProcess fused in a single kernel without intermediate arrays.
+# sensor_mat is a stack of frames (N,H,W), sensor_at the vector of their ambient temperatures (N,),
+# and bounds holds (temperature_upper_bound, 255) in the dtype of sensor_mat, so the arithmetic stays in that dtype.
+# Returns the band-passed frames and the uint8 frames, which are identical to the NumPy implementation.
+def BandPassScaleKernel(sensor_mat, sensor_at, bounds):
+    N, H, W = sensor_mat.shape
+    upper_bound = bounds[0]
+    full_scale = bounds[1]
+    matrix1 = np.empty(sensor_mat.shape, sensor_mat.dtype)
+    matrix3 = np.empty(sensor_mat.shape, np.uint8)
+    for n in range(N):
+        for i in range(H):
+            for j in range(W):
+                v = sensor_mat[n, i, j]
+                matrix1[n, i, j] = v if v < upper_bound else sensor_at[n]
+        min_v = matrix1[n, 0, 0]
+        for i in range(H):
+            for j in range(W):
+                if matrix1[n, i, j] < min_v:
+                    min_v = matrix1[n, i, j]
+        scale = upper_bound - min_v
+        for i in range(H):
+            for j in range(W):
+                matrix3[n, i, j] = np.uint8((matrix1[n, i, j] - min_v) / scale * full_scale)
+    return matrix1, matrix3
+
+if nb is not None:
+    # cache=True keeps the compiled kernel on disk, so it is only compiled at the first run.
+    BandPassScaleKernel = nb.njit(cache=True)(BandPassScaleKernel)
 
 
 ############ This part is the preprocessing pipline:
@@ -98,81 +232,67 @@ class Preprocess():
         self.chessboard_inverse = np.where((chessboard==0)|(chessboard==1), chessboard^1, chessboard)
          
     def Outlier1TypeDelete(self, mat):
-        subpage0 = mat * self.chessboard
-        subpage1 = mat* self.chessboard_inverse
+        """
+        mat can be a single sample (24,32) or a recording (N,24,32).
+        Returns True if we can keep the sample, False if we need to discard it (one boolean per sample for a recording).
+        """
         num_pixels_subpage = int(np.sum(self.chessboard))
-        if np.sum(subpage0) > 300*num_pixels_subpage or np.sum(subpage1) > 300*num_pixels_subpage:
-            return 0     # we need to discard this sample
-        return 1         # we can keep this sample
-    
+        subpage0_sum = np.sum(mat * self.chessboard, axis=(-2, -1))
+        subpage1_sum = np.sum(mat * self.chessboard_inverse, axis=(-2, -1))
+        return (subpage0_sum <= 300*num_pixels_subpage) & (subpage1_sum <= 300*num_pixels_subpage)
+
     def Outlier2TypeElimilate(self, mat):
-        mat_copy = mat.copy()
-        outlier_position = np.where(mat>300)
-        rows = outlier_position[0]
-        cols = outlier_position[1]
-        stats = 1      # there is no outliers in this sample
-        for index,row in enumerate(rows):
-            i = row
-            j = cols[index]
-            num = 0
-            stats = 2    # there exists outliers in this sample
-            try:
-                topleft = mat_copy[i-1,j-1]
-                num = num+1
-            except:
-                topleft = 0.0
-            
-            try:
-                bottomleft = mat_copy[i+1,j-1]
-                num = num+1
-            except:
-                bottomleft = 0.0
-            
-            try:
-                topright = mat_copy[i-1,j+1]
-                num = num+1
-            except:
-                topright = 0.0
-            
-            try:
-                bottomright = mat_copy[i+1,j+1]
-                num = num+1
-            except:
-                bottomright = 0.0
-            mat_copy[i,j] = (topleft + bottomleft + topright + bottomright)/num
+        # replacing every outlier by the average of its valid diagonal neighbours (the same subpage) in one pass.
+        outliers = mat > 300
+        repaired = NeighbourAverage(mat, ~outliers, NEIGHBOURS_DIAGONAL)
+        mat_copy = np.where(outliers, repaired, mat)
+        stats = np.where(np.any(outliers, axis=(-2, -1)), 2, 1)    # 1: there is no outliers, 2: there exists outliers
+        if mat.ndim == 2:
+            stats = int(stats)
         return mat_copy, stats
-    
+
     def Forward(self, mat):
         """
+        mat can be a single sample (24,32) or a recording (N,24,32), stats has one entry per sample.
         stats:
             0: discard this sample.
             1: all pixels are perfect.
             2: there are some outliers in this sample but fixed by interpolating.
         """
-        mat = mat.copy()
-        stats = self.Outlier1TypeDelete(mat)
-        if stats:
-            mat, stats = self.Outlier2TypeElimilate(mat)
+        mat = np.array(mat)
+        valid = self.Outlier1TypeDelete(mat)
+        if mat.ndim == 2:
+            if not valid:
+                return mat, 0
+            return self.Outlier2TypeElimilate(mat)
+        repaired, stats = self.Outlier2TypeElimilate(mat)
+        mat = np.where(valid[:, None, None], repaired, mat)
+        stats = np.where(valid, stats, 0)
         return mat, stats
 
 # second component: Change the IRA data to a Image-like version
 class BaseProcess():
-    def __init__(self, expansion_coefficient = 20, temperature_upper_bound = 34) -> None:
+    def __init__(self, expansion_coefficient = 20, temperature_upper_bound = 34, use_numba = True) -> None:
         """Initailization
 
         Args:
             expansion_coefficient (int, optional): the shape expansion ratio of the received temperature matrix. Defaults to 20.
             temperature_upper_bound (int, optional): the highest temperature that is considered. Defaults to 33.
+            use_numba (bool, optional): using the numba compiled BandPassScaleKernel in SharedBandPassForward if numba is installed. Defaults to True.
         """
         self.expansion_coefficient = expansion_coefficient
         self.temperature_upper_bound = temperature_upper_bound
+        self.use_numba = use_numba and nb is not None
     
+    # BandPass, Normalize, ChangeScale and Interpolate also accept a stack of frames (N,24,32),
+    # in which case sensor_at is the vector of the N ambient temperatures.
     def BandPass(self, sensor_mat, sensor_at):
+        sensor_at = np.reshape(np.asarray(sensor_at, dtype=sensor_mat.dtype), np.shape(sensor_at) + (1, 1))
         matrix1 = np.where(sensor_mat < self.temperature_upper_bound, sensor_mat, sensor_at)
         return matrix1
     
     def Normalize(self,sensor_mat):
-        min_v = np.min(sensor_mat)
+        min_v = np.min(sensor_mat, axis=(-2, -1), keepdims=True)
         matrix2 = (sensor_mat - min_v) / (self.temperature_upper_bound-min_v)
         return matrix2
     
@@ -181,19 +301,22 @@ class BaseProcess():
         return matrix3
     
     def Interpolate(self, sensor_mat):
-        original_shape = sensor_mat.shape
-        matrix4 = cv2.resize(sensor_mat, 
-                             (original_shape[1]* self.expansion_coefficient,original_shape[0]* self.expansion_coefficient), 
-                             interpolation=cv2.INTER_LINEAR
-                             )
+        original_shape = sensor_mat.shape[-2:]
+        dsize = (original_shape[1]* self.expansion_coefficient,original_shape[0]* self.expansion_coefficient)
+        if sensor_mat.ndim == 2:
+            matrix4 = cv2.resize(sensor_mat, dsize, interpolation=cv2.INTER_LINEAR)
+            return matrix4, original_shape
+        matrix4 = np.empty((sensor_mat.shape[0], dsize[1], dsize[0]), sensor_mat.dtype)
+        for index in range(sensor_mat.shape[0]):
+            cv2.resize(sensor_mat[index], dsize, dst=matrix4[index], interpolation=cv2.INTER_LINEAR)
         return matrix4, original_shape
     
     def Forward(self, sensor_mat, sensor_at):
         """processing
 
         Args:
-            sensor_mat (numpy.array): the temperature matrix from IRA sensor
-            sensor_at (float): the detected ambient temperature from IRA sensor
+            sensor_mat (numpy.array): the temperature matrix from IRA sensor, or a stack of them (N,24,32)
+            sensor_at (float): the detected ambient temperature from IRA sensor, or a vector of them (N,)
 
         Returns:
             (numpy.array, tuple): the processed temperature matrix, the original shape of the temperature matrix.
@@ -204,10 +327,101 @@ class BaseProcess():
         matrix4, original_shape = self.Interpolate(matrix3)
         return matrix4, original_shape
 
+    def SharedBandPassForward(self, sensor_mat, sensor_at):
+        """processing with one band-pass shared by the image and the temperature matrix. Only the uint8 image is upscaled,
+        with the same cv2.resize as Forward, so it is unchanged. The temperature matrix is not upscaled here, it is a
+        TemperatureMatrix that interpolates the requested windows from the band-passed frame on demand.
+
+        Args:
+            sensor_mat (numpy.array): the temperature matrix from IRA sensor, or a stack of them (N,24,32)
+            sensor_at (float): the detected ambient temperature from IRA sensor, or a vector of them (N,)
+
+        Returns:
+            (numpy.array, TemperatureMatrix): the processed image (uint8), the interpolated temperature matrix.
+        """
+        if self.use_numba:
+            frames = np.reshape(sensor_mat, (-1,) + np.shape(sensor_mat)[-2:])
+            ambient = np.broadcast_to(np.asarray(sensor_at, dtype=frames.dtype), frames.shape[:1])
+            bounds = np.array([self.temperature_upper_bound, 255], dtype=frames.dtype)
+            matrix1, matrix3 = BandPassScaleKernel(frames, np.ascontiguousarray(ambient), bounds)
+            matrix1 = matrix1.reshape(np.shape(sensor_mat))
+            matrix3 = matrix3.reshape(np.shape(sensor_mat))
+        else:
+            matrix1 = self.BandPass(sensor_mat, sensor_at)
+            matrix2 = self.Normalize(matrix1)
+            matrix3 = self.ChangeScale(matrix2)
+        matrix4, _ = self.Interpolate(matrix3)
+        return matrix4, TemperatureMatrix(matrix1, self.expansion_coefficient)
+
+# the source indices and weights that cv2.resize (INTER_LINEAR) uses to upscale an axis of the given length.
+@functools.lru_cache(maxsize=None)
+def LinearInterpolationTable(length, expansion_coefficient):
+    position = (np.arange(length * expansion_coefficient) + 0.5) / expansion_coefficient - 0.5
+    index0 = np.floor(position).astype(np.int64)
+    weight1 = position - index0
+    weight1[index0 < 0] = 0
+    index0[index0 < 0] = 0
+    weight1[index0 >= length-1] = 0
+    index0[index0 >= length-1] = length-1
+    index1 = np.minimum(index0 + 1, length-1)
+    return index0, index1, 1 - weight1, weight1
+
+class TemperatureMatrix():
+    """The interpolated temperature matrix (ira_mat) that is only computed when it is sliced.
+
+    ira_mat[y:y+h, x:x+w] gives the same values as slicing the full-frame cv2.resize output (up to floating point rounding),
+    but only the h*w window is interpolated from the low-resolution band-passed frame.
+    For a stack of frames (N,24,32), ira_mat[i] gives the TemperatureMatrix of the i-th frame.
+    np.array(ira_mat) computes the whole matrix.
+    """
+    def __init__(self, source, expansion_coefficient):
+        self.source = source
+        self.expansion_coefficient = expansion_coefficient
+        self.shape = source.shape[:-2] + (source.shape[-2] * expansion_coefficient, source.shape[-1] * expansion_coefficient)
+        self.ndim = source.ndim
+        self.dtype = source.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        num_frame_axes = self.source.ndim - 2
+        frame_key, window_key = key[:num_frame_axes], key[num_frame_axes:]
+        source = self.source[frame_key] if len(frame_key) > 0 else self.source
+        if len(window_key) == 0:
+            return TemperatureMatrix(source, self.expansion_coefficient)
+        window_key = window_key + (slice(None),) * (2 - len(window_key))
+        if all(isinstance(k, slice) and k.step in (None, 1) for k in window_key):
+            return self.Window(source, window_key[0], window_key[1])
+        return self.Window(source, slice(None), slice(None))[(Ellipsis,) + window_key]
+
+    def __array__(self, dtype=None, copy=None):
+        mat = self.Window(self.source, slice(None), slice(None))
+        return mat if dtype is None else mat.astype(dtype)
+
+    def Window(self, source, rows, cols):
+        # separable bilinear interpolation of the window, restricted to the source rows that the window needs.
+        H, W = source.shape[-2:]
+        r0, r1, a0, a1 = [t[rows] for t in LinearInterpolationTable(H, self.expansion_coefficient)]
+        c0, c1, b0, b1 = [t[cols] for t in LinearInterpolationTable(W, self.expansion_coefficient)]
+        a0, a1, b0, b1 = [w.astype(source.dtype) for w in (a0, a1, b0, b1)]
+        if len(r0) == 0 or len(c0) == 0:
+            return np.zeros(source.shape[:-2] + (len(r0), len(c0)), source.dtype)
+        first_row = r0[0]
+        source_rows = source[..., first_row:r1[-1]+1, :]
+        horizontal = source_rows[..., c0] * b0 + source_rows[..., c1] * b1
+        return horizontal[..., r0-first_row, :] * a0[:, None] + horizontal[..., r1-first_row, :] * a1[:, None]
+
 # The pipeline of the preprocessing 
+# dtype policy of the pipeline: temperatures are processed in TEMPERATURE_DTYPE, masks are uint8 (0/1 or 0/255) or bool.
+TEMPERATURE_DTYPE = np.float32
+
 class PrePipeline():
-    def __init__(self,expansion_coefficient = 10, temperature_upper_bound = 34, buffer_size = 10, data_shape = (24,32)) -> None:
+    def __init__(self,expansion_coefficient = 10, temperature_upper_bound = 34, buffer_size = 10, data_shape = (24,32), dtype = TEMPERATURE_DTYPE) -> None:
         self.expansion_coefficient = expansion_coefficient
+        self.dtype = dtype
         self.temperature_upper_bound = temperature_upper_bound
         self.buffer = []
         self.buffer_size = buffer_size
@@ -217,244 +431,690 @@ class PrePipeline():
     
     def PreProcessing(self, sensor_mat):
         # subpage, stats = self.preprocessor.Forward(np.flip(sensor_mat,0))
-        subpage, stats = self.preprocessor.Forward(sensor_mat)
+        subpage, stats = self.preprocessor.Forward(np.asarray(sensor_mat, dtype=self.dtype))
         if stats == 0:
+            instrumentation.Count("invalid_subpage")
             print("This subpage is invalid!")
             return 0, subpage
         if stats == 2:
+            instrumentation.Count("repaired_subpage")
             print("This subpage contains outliers that have been replaced by using average values of their nearby elements.")
         frame = SubpageInterpolating(subpage)     # interpolate the subpage into complete frame
         return frame, subpage
     
     def Forward(self, sensor_mat, sensor_at):
-        frame, subpage = self.PreProcessing(sensor_mat)
-        if not isinstance(frame, (np.ndarray)):
-            return 0, 0, 0
-        subpage_type = SubpageType(subpage, self.chessboard)
-        ira_img, _ = self.basic_process.Forward(frame, sensor_at)
-        
-        original_shape = frame.shape
-        bandpass_frame = self.basic_process.BandPass(frame, sensor_at)
-        ira_mat = cv2.resize(bandpass_frame, 
-                            (original_shape[1]* self.expansion_coefficient,original_shape[0]* self.expansion_coefficient), 
-                            interpolation=cv2.INTER_LINEAR
-                            )
+        with instrumentation.Stage("preprocess"):
+            frame, subpage = self.PreProcessing(sensor_mat)
+            if not isinstance(frame, (np.ndarray)):
+                return 0, 0, 0
+            subpage_type = SubpageType(subpage, self.chessboard)
+            ira_img, ira_mat = self.basic_process.SharedBandPassForward(frame, sensor_at)
         
         self.buffer.append((ira_img, subpage_type))
         if len(self.buffer) > self.buffer_size:
             self.buffer.pop(0)
-            
+
         return ira_img, subpage_type, ira_mat
+
+    def ForwardBatch(self, frames, ambient):
+        """processing a whole recording at once, which is the same as calling Forward on every frame.
+
+        Args:
+            frames (numpy.array): the temperature matrices from IRA sensor, (N,24,32)
+            ambient (numpy.array): the detected ambient temperature of every frame, (N,)
+
+        Returns:
+            (numpy.array, numpy.array, TemperatureMatrix, numpy.array): ira_img (N,H,W), subpage_type (N,), ira_mat (N,H,W) and
+            the validity mask (N,). The outputs of invalid frames are all zeros.
+        """
+        with instrumentation.Stage("preprocess_batch"):
+            frames = np.asarray(frames, dtype=self.dtype)
+            ambient = np.asarray(ambient, dtype=self.dtype)
+            subpages, stats = self.preprocessor.Forward(frames)
+            valid = stats > 0
+            frames = SubpageInterpolating(subpages)
+            subpage_type = SubpageType(subpages, self.chessboard)
+            frames[~valid] = 0
+            ira_img, ira_mat = self.basic_process.SharedBandPassForward(frames, ambient)
+            ira_img[~valid] = 0
+            subpage_type[~valid] = 0
+        instrumentation.Count("invalid_subpage", int(np.sum(stats == 0)))
+        instrumentation.Count("repaired_subpage", int(np.sum(stats == 2)))
+
+        for index in np.flatnonzero(valid)[-self.buffer_size:]:
+            self.buffer.append((ira_img[index], subpage_type[index]))
+            if len(self.buffer) > self.buffer_size:
+                self.buffer.pop(0)
+
+        return ira_img, subpage_type, ira_mat, valid
+
+
+class ActivityGate():
+    """The gate in front of the detector that skips the empty and the static frames.
+
+    A frame is "absent" (no one present) when the maximum of its band-passed temperature matrix is below the human
+    temperature floor, "static" when it differs from the background model in at most changed_pixel_limit sensor pixels,
+    and "active" otherwise. The background model is the mean of the last buffer_size band-passed matrices, the same
+    ring as PrePipeline.buffer. The gate keeps its own ring because PrePipeline.ForwardBatch fills PrePipeline.buffer
+    ahead of the frame that is being detected.
+    """
+    ACTIVE = "active"
+    STATIC = "static"
+    ABSENT = "absent"
+
+    def __init__(self, buffer_size = 10, temperature_floor = 26.0, change_threshold = 1.0, changed_pixel_limit = 5, max_static_frames = 5) -> None:
+        """Initailization
+
+        Args:
+            buffer_size (int, optional): the number of frames in the background model. Defaults to 10.
+            temperature_floor (float, optional): the lowest maximum temperature of a frame with someone in view. Defaults to 26.0.
+            change_threshold (float, optional): the temperature difference of a changed pixel to the background. Defaults to 1.0.
+            changed_pixel_limit (int, optional): the most changed pixels of a static frame. Defaults to 5.
+            max_static_frames (int, optional): the most successive static frames, after which a frame is active anyway. Defaults to 5.
+        """
+        self.buffer_size = buffer_size
+        self.temperature_floor = temperature_floor
+        self.change_threshold = change_threshold
+        self.changed_pixel_limit = changed_pixel_limit
+        self.max_static_frames = max_static_frames
+        self.buffer = []
+        self.background_sum = None
+        self.static_frames = 0
+        self.counts = {self.ACTIVE: 0, self.STATIC: 0, self.ABSENT: 0}
+
+    def Reset(self):
+        self.buffer = []
+        self.background_sum = None
+        self.static_frames = 0
+        self.counts = {self.ACTIVE: 0, self.STATIC: 0, self.ABSENT: 0}
+
+    def Background(self):
+        return self.background_sum / len(self.buffer)
+
+    def SkipRatio(self):
+        # the share of the frames on which the detection was skipped
+        total = sum(self.counts.values())
+        return (self.counts[self.STATIC] + self.counts[self.ABSENT]) / total if total > 0 else 0.0
+
+    def Forward(self, ira_mat):
+        """classifying the frame and adding it to the background model
+
+        Args:
+            ira_mat (TemperatureMatrix or numpy.array): the band-passed temperature matrix of the frame (the output of PrePipeline)
+
+        Returns:
+            str: ActivityGate.ACTIVE, ActivityGate.STATIC or ActivityGate.ABSENT
+        """
+        with instrumentation.Stage("activity_gate"):
+            source = ira_mat.source if isinstance(ira_mat, TemperatureMatrix) else np.asarray(ira_mat)
+            source = source.astype(np.float64)
+            if source.max() < self.temperature_floor:
+                state = self.ABSENT
+            elif len(self.buffer) == self.buffer_size and self.static_frames < self.max_static_frames and \
+                    np.count_nonzero(np.abs(source - self.Background()) > self.change_threshold) <= self.changed_pixel_limit:
+                state = self.STATIC
+            else:
+                state = self.ACTIVE
+
+            self.buffer.append(source)
+            self.background_sum = source.copy() if self.background_sum is None else self.background_sum + source
+            if len(self.buffer) > self.buffer_size:
+                self.background_sum -= self.buffer.pop(0)
+        self.static_frames = self.static_frames + 1 if state == self.STATIC else 0
+        self.counts[state] += 1
+        instrumentation.Count("gate_" + state)
+        return state
 ############# End of the preprocessing
 
 
 ############# The segmentation part
+# The drift scan of the vertical cutting edges.
+# diff holds the differences between the means of the 20 pixels windows left and right of every edge (K, rows),
+# edges the columns of the K edges. Returns the first and last+1 cut columns of every row, normalized like the
+# Python slices of a row with width columns, which is what the row by row loop did.
+def DriftScanKernel(diff, edges, stride, lambda_x, width):
+    K, Y = diff.shape
+    starts = np.empty((K, Y), np.int64)
+    stops = np.empty((K, Y), np.int64)
+    for k in range(K):
+        last_drift = 0.0
+        last_cut_pt = edges[k]
+        for row in range(Y):
+            drift = lambda_x * diff[k, row] + (1-lambda_x) * last_drift
+            current_cut_pt = int(drift*stride + edges[k])
+            if current_cut_pt < last_cut_pt:
+                start, stop = current_cut_pt, last_cut_pt+1
+            else:
+                start, stop = last_cut_pt, current_cut_pt+1
+            if start < 0:
+                start = max(start + width, 0)
+            elif start > width:
+                start = width
+            if stop < 0:
+                stop = max(stop + width, 0)
+            elif stop > width:
+                stop = width
+            starts[k, row] = start
+            stops[k, row] = stop
+            last_cut_pt = current_cut_pt
+            last_drift = drift
+    return starts, stops
+
+if nb is not None:
+    DriftScanKernel = nb.njit(cache=True)(DriftScanKernel)
+
+def DriftCuttingMask(mask_frame, edges, stride, lambda_x, x_offset = 0, width = None):
+    """cutting along vertical edges that drift row by row towards the side with the lower mean (20 pixels windows)
+
+    Args:
+        mask_frame (numpy.array): the masked frame, or its crop starting at column x_offset, the crop has to contain the windows beside the edges.
+        edges (list): the columns of the edges in the frame coordinates.
+        stride (float): the ratio between the drift and the moving of the edge.
+        lambda_x (float): the smoothing factor of the drift.
+        x_offset (int, optional): the first column of the crop. Defaults to 0.
+        width (int, optional): the width of the frame. Defaults to None (the width of mask_frame).
+
+    Returns:
+        numpy.array: ones in the shape of mask_frame, the cutting edges are 0.
+    """
+    Y_dim, X_dim = mask_frame.shape
+    if width is None:
+        width = X_dim
+    mask_2 = np.ones_like(mask_frame)
+    if len(edges) == 0:
+        return mask_2
+    edges = np.array([int(e) for e in edges], np.int64)
+    # the left and right windows of every edge as (start, stop) columns of the crop, following the slicing of a row
+    windows = []
+    for t in edges:
+        left = slice(max(t-20, 0), t).indices(width)
+        right = slice(t, min(t + 20, width)).indices(width)
+        windows.append([(start - x_offset, max(stop, start) - x_offset) for start, stop, _ in (left, right)])
+    windows = np.array(windows)
+    # the window means come from per-row prefix sums over the columns of the windows, which are exact for the integer frames
+    accumulator = np.int64 if np.issubdtype(mask_frame.dtype, np.integer) else np.float64
+    first, last = windows.min(), windows.max()
+    prefix = np.zeros((Y_dim, last - first + 1), accumulator)
+    np.cumsum(mask_frame[:, first:last], axis = 1, dtype = accumulator, out = prefix[:, 1:])
+    windows = windows - first
+    diff = np.empty((len(edges), Y_dim))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k, ((left_start, left_stop), (right_start, right_stop)) in enumerate(windows):
+            left_mean = (prefix[:, left_stop] - prefix[:, left_start]) / (left_stop - left_start)
+            right_mean = (prefix[:, right_stop] - prefix[:, right_start]) / (right_stop - right_start)
+            diff[k] = left_mean - right_mean
+    empty = np.isnan(diff).any(axis = 1)
+    if empty.any():
+        # an empty window at the frame border, the drift is undefined
+        raise ValueError("empty drift window at column %d" % edges[np.argmax(empty)])
+    starts, stops = DriftScanKernel(diff, edges, float(stride), float(lambda_x), width)
+    columns = np.arange(x_offset, x_offset + X_dim)
+    for k in range(len(edges)):
+        mask_2[(columns >= starts[k, :, None]) & (columns < stops[k, :, None])] = 0
+    return mask_2
+
+# the 5th order Butterworth low pass filter of the column histograms, the design only depends on the histogram length
+# and the cutoff, so it is shared by all regions and frames. An invalid cutoff raises the ValueError of signal.butter.
+@functools.lru_cache(maxsize=1024)
+def ButterworthLowPass(length, cutoff):
+    w = cutoff / (length / 2)
+    return signal.butter(5, w, 'low')
+
+# The dynamic programming of the multi-Otsu thresholds, from the cumulative zeroth and first moments of the bins.
+# Row c-1 of the returned table holds, for every last bin j, the best last threshold of the bins [0, j] in c+1 classes.
+def MultiOtsuKernel(zeroth_moment, first_moment, classes):
+    nbins = len(zeroth_moment)
+    best = np.empty(nbins)
+    for j in range(nbins):
+        best[j] = first_moment[j] * first_moment[j] / zeroth_moment[j] if zeroth_moment[j] > 0 else 0.0
+    last_thresholds = np.zeros((classes - 1, nbins), np.int64)
+    for c in range(1, classes):
+        next_best = np.full(nbins, -np.inf)
+        for j in range(nbins):
+            for i in range(j):
+                n = zeroth_moment[j] - zeroth_moment[i]
+                score = best[i]
+                if n > 0:
+                    m = first_moment[j] - first_moment[i]
+                    score += m * m / n
+                if score > next_best[j]:
+                    next_best[j] = score
+                    last_thresholds[c-1, j] = i
+        best = next_best
+    return last_thresholds
+
+if nb is not None:
+    MultiOtsuKernel = nb.njit(cache=True)(MultiOtsuKernel)
+
+def MultiOtsuThresholds(hist, bin_centers, classes):
+    """the multi-Otsu thresholds of a 1-D histogram, exact for any number of classes
+
+    It maximizes the between-class variance like skimage.filters.threshold_multiotsu, but from cumulative moment tables
+    and dynamic programming over the last threshold, which costs O(classes * bins^2) instead of O(bins^(classes-1)).
+
+    Args:
+        hist (numpy.array): the counts of the bins.
+        bin_centers (numpy.array): the centers of the bins.
+        classes (int): the number of classes.
+
+    Returns:
+        numpy.array: the classes-1 thresholds.
+    """
+    prob = np.asarray(hist, dtype=np.float64)
+    prob = prob / np.sum(prob)
+    nonzero_index = np.flatnonzero(prob)
+    if len(nonzero_index) < classes:
+        raise ValueError("The histogram has only %d different values, it cannot be thresholded in %d classes." % (len(nonzero_index), classes))
+    if len(nonzero_index) == classes:
+        return np.asarray(bin_centers)[nonzero_index[:-1]]
+    
+    # an empty class never helps, so the thresholds are searched between the first and the last nonzero bins only.
+    first_nonzero_index = nonzero_index[0]
+    prob = prob[first_nonzero_index:nonzero_index[-1]+1]
+    nbins = len(prob)
+    # the class of the bins [a, b] adds (first moment)^2 / (zeroth moment) to the between-class variance
+    zeroth_moment = np.cumsum(prob)
+    first_moment = np.cumsum(prob * np.arange(first_nonzero_index, first_nonzero_index + nbins))
+    if nb is not None:
+        last_thresholds = MultiOtsuKernel(zeroth_moment, first_moment, classes)
+    else:
+        # the same dynamic programming on the tables of all classes
+        with np.errstate(divide='ignore', invalid='ignore'):
+            first_class = np.where(zeroth_moment > 0, first_moment * first_moment / zeroth_moment, 0.0)
+            # next_class[j, i]: the class of the bins [i+1, j] after the threshold i (-inf unless i < j)
+            n = zeroth_moment[:, None] - zeroth_moment[None, :]
+            m = first_moment[:, None] - first_moment[None, :]
+            next_class = m * m / n
+        next_class[n <= 0] = 0.0
+        next_class[~np.tri(nbins, k=-1, dtype=bool)] = -np.inf
+        
+        # best[j]: the largest variance of the bins [0, j] split in c classes (-inf if it cannot be split)
+        best = first_class
+        last_thresholds = []
+        for c in range(1, classes):
+            scores = best[None, :] + next_class
+            last_threshold = np.argmax(scores, axis = 1)
+            best = scores[np.arange(nbins), last_threshold]
+            last_thresholds.append(last_threshold)
+    
+    thresh_idx = []
+    j = nbins - 1
+    for last_threshold in reversed(last_thresholds):
+        j = last_threshold[j]
+        thresh_idx.append(j)
+    return np.asarray(bin_centers)[np.array(thresh_idx[::-1]) + first_nonzero_index]
+
+class ConnectedComponents():
+    """The regions of a binary mask from one labeling pass, shared by the segmentation steps.
+
+    The labels (8-connectivity, 0 is the background) follow the raster order of skimage.measure.label. Filtering the
+    regions only changes the selected labels, the label image and the stats table (bbox and pixel count) are reused.
+    A single region is accessed through its bbox slices, so the per-region steps work on crops of the frame.
+    """
+    def __init__(self, mask) -> None:
+        foreground = (np.asarray(mask) != 0).view(np.uint8)
+        num, labels, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=8, ltype=cv2.CV_32S)
+        stats = stats.astype(np.int64)
+        if num > 2:
+            # the raster position of the first pixel of each region.
+            first = np.empty(num - 1, np.int64)
+            for i in range(1, num):
+                left, top, width = stats[i, :3]
+                first[i-1] = top * labels.shape[1] + left + np.argmax(labels[top, left:left+width] == i)
+            order = np.argsort(first)
+            if np.any(np.diff(order) != 1):
+                lut = np.zeros(num, np.int32)
+                lut[order + 1] = np.arange(1, num, dtype=np.int32)
+                labels = lut[labels]
+                stats[1:] = stats[order + 1]
+        self.labels = labels
+        self.stats = stats
+        self.num = num
+        self.ids = np.arange(1, num)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def Areas(self):
+        return self.stats[self.ids, cv2.CC_STAT_AREA]
+    
+    def BBoxes(self):
+        # (x, y, w, h) of the selected regions
+        return self.stats[self.ids, :4]
+    
+    def Slices(self, index, margin = 0):
+        # the bbox of the index-th selected region as (rows, columns) slices, enlarged by margin pixels
+        H, W = self.labels.shape
+        x, y, w, h = self.stats[self.ids[index], :4]
+        return (slice(max(y - margin, 0), min(y + h + margin, H)), slice(max(x - margin, 0), min(x + w + margin, W)))
+    
+    def RegionMask(self, index, slices = None, dtype = np.uint8):
+        # the mask (values 0 and 1) of the index-th selected region, cropped by slices
+        labels = self.labels if slices is None else self.labels[slices]
+        return np.asarray(labels == self.ids[index], dtype=dtype)
+    
+    def Select(self, selected):
+        # selected: a boolean array or the indexes of the regions to keep
+        regions = copy.copy(self)
+        regions.ids = self.ids[selected]
+        return regions
+    
+    def TopK(self, topk):
+        idx = np.argsort(self.Areas())[::-1]
+        if topk < len(idx):
+            idx = idx[:topk]
+        return self.Select(np.sort(idx))
+    
+    def Mask(self, value = 255, dtype = np.uint8):
+        lut = np.zeros(self.num, dtype)
+        lut[self.ids] = value
+        return lut[self.labels]
+    
+    def Crops(self, dtype = np.uint8):
+        # (rows, columns, mask) of every selected region, the mask is cropped by the bbox slices
+        crops = []
+        for i in range(len(self.ids)):
+            rows, columns = self.Slices(i)
+            crops.append((rows, columns, self.RegionMask(i, (rows, columns), dtype)))
+        return crops
+    
+    def RegionMasks(self, dtype = np.uint8):
+        # one mask (values 0 and 1) per region
+        return [np.asarray(self.labels == i, dtype=dtype) for i in self.ids]
+    
+    def Colored(self, dtype = np.uint8):
+        # giving the regions different values between 70 and 190
+        lut = np.zeros(self.num, dtype)
+        lut[self.ids] = np.linspace(70, 190, len(self.ids))
+        return lut[self.labels]
+
 # first component: considering the spatial information
 class DetectingProcess():
-    def __init__(self, expansion_coefficient = 20, valid_region_area_limit = 5) -> None:
+    def __init__(self, expansion_coefficient = 20, valid_region_area_limit = 5, threshold_downscale = 1, coarse_expansion_coefficient = None, lean = False) -> None:
         """Initailization
 
         Args:
             expansion_coefficient (int, optional): the shape expansion ratio of the received temperature matrix. Defaults to 20.
             valid_region_area_limit (int, optional): the area of the smallest region that is considered. Defaults to 20.
+            threshold_downscale (int, optional): computing the adaptive threshold on the frame downscaled by this factor,
+                e.g. expansion_coefficient for the sensor grid. Defaults to 1 (the full resolution).
+            coarse_expansion_coefficient (int, optional): finding the candidate regions at this expansion ratio (e.g. 4) and
+                splitting them at expansion_coefficient inside their bboxes only. Defaults to None (a single resolution).
+            lean (bool, optional): skipping the colored mask and the bounding boxes, which Forward returns as None. Defaults to False.
         """
         self.expansion_coefficient = expansion_coefficient
         self.valid_region_area_limit = valid_region_area_limit
+        self.threshold_downscale = threshold_downscale
+        self.coarse_expansion_coefficient = coarse_expansion_coefficient
+        self.lean = lean
 
     def AdaptiveBinary(self,sensor_mat,maximum, box_size):
         """
         https://docs.opencv.org/4.7.0/d7/d1b/group__imgproc__misc.html#ga72b913f352e4a1b1b397736707afcde3
         """
+        if self.threshold_downscale > 1:
+            return self.LowResolutionAdaptiveBinary(sensor_mat, maximum, box_size, self.threshold_downscale)
         mask = cv2.adaptiveThreshold(sensor_mat, maximum,cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, box_size, 0)
         return mask
     
+    def ThresholdSurface(self, sensor_mat, box_size, downscale):
+        # the Gaussian threshold surface of cv2.adaptiveThreshold computed on the frame downscaled by downscale.
+        # Returns the downscaled frame and its threshold surface.
+        H, W = sensor_mat.shape
+        small = cv2.resize(sensor_mat.astype(np.float32), (max(W // downscale, 1), max(H // downscale, 1)), interpolation = cv2.INTER_AREA)
+        sigma = (0.3 * ((box_size - 1) * 0.5 - 1) + 0.8) / downscale  # the sigma that cv2.adaptiveThreshold uses for box_size
+        ksize = int(box_size / downscale) // 2 * 2 + 1
+        surface = cv2.GaussianBlur(small, (ksize, ksize), sigma, borderType = cv2.BORDER_REPLICATE)
+        return small, surface
+    
+    def LowResolutionAdaptiveBinary(self, sensor_mat, maximum, box_size, downscale):
+        # the threshold surface of the downscaled frame is upsampled and compared with the frame at the full resolution.
+        H, W = sensor_mat.shape
+        _, surface = self.ThresholdSurface(sensor_mat, box_size, downscale)
+        surface = cv2.resize(surface, (W, H), interpolation = cv2.INTER_LINEAR)
+        mask = np.where(sensor_mat > np.rint(surface), maximum, 0).astype(np.uint8)
+        return mask
+    
+    def BorderFilter(self, regions):
+        # removing regions connected to up, left, and right borders, the regions connected to the bottom border are kept.
+        H, W = regions.labels.shape
+        x, y, w, h = regions.BBoxes().T
+        bottom = y + h == H
+        border = (x == 0) | (y == 0) | (x + w == W)
+        return regions.Select(bottom | ~border)
+    
+    def AreaFilter(self, regions, pixel_limit):
+        # discarding the regions with areas less than pixels limit.
+        return regions.Select(regions.Areas() > pixel_limit)
+    
     def BorderRemove(self, mask):
         # removing regions connected to up, left, and right borders in the mask.
-        mask_labeled_temp = label(mask)
-        mask2 = np.zeros_like(mask)
-        rps_temp = regionprops(mask_labeled_temp)
-        for i in range(len(rps_temp)):
-            corordinates = rps_temp[i].coords.T
-            if mask.shape[0]-1 in corordinates[0]: # regions connected to the bottom border.
-                mask2[tuple(corordinates)] = 255
-            elif (0 in corordinates[1]) or 0 in corordinates[0]  or (mask.shape[1]-1 in corordinates[1]):  # regions connected to left,right,up borders.
-                pass
-            else:                                              # regions inside the image
-                mask2[tuple(corordinates)] = 255
-        return mask2
+        return self.BorderFilter(ConnectedComponents(mask)).Mask(255, mask.dtype)
     
     def BlobRemove(self, mask, pixel_limit):
         # discarding the regions with areas less than pixels limit. 
-        mask2_labeled = label(mask)
-        rps = regionprops(mask2_labeled)
-        areas = [r.area for r in rps]
-        mask3 = np.zeros_like(mask)
-        for i in range(len(areas)):
-            if areas[i] > pixel_limit:
-                mask3[tuple(rps[i].coords.T)] = 255
-        return mask3
+        return self.AreaFilter(ConnectedComponents(mask), pixel_limit).Mask(255, mask.dtype)
     
     def RegionDivid(self, mask):
-        masks = []
-        copy_mask = mask.copy()
-        label_mask = label(copy_mask)
-        rps = regionprops(label_mask)
-        for i in range(len(rps)):
-            corordinates = rps[i].coords.T
-            temp_mask = np.zeros_like(mask)
-            temp_mask[tuple(corordinates)] = 1
-            masks.append(temp_mask)
-        return masks
+        return ConnectedComponents(mask).RegionMasks(mask.dtype)
     
     def TopKRegion(self, mask, topk):
         # keep top k regions
-        mask_labeled = label(mask)
-        rps = regionprops(mask_labeled)
-        areas = [r.area for r in rps]
-        idx = np.argsort(areas)[::-1]
-        if topk < len(idx):
-            selected_index = idx[:topk]
-        else:
-            selected_index = idx
-        topk_mask = np.zeros_like(mask)
-        for index in selected_index:
-            topk_mask[tuple(rps[index].coords.T)] = 255
-        return topk_mask
+        return ConnectedComponents(mask).TopK(topk).Mask(255, mask.dtype)
     
     def RegionColored(self,mask):
         # Given different region with different values
-        mask_labeled = label(mask)
-        rps = regionprops(mask_labeled)
-        num_regions = len(rps)
-        if num_regions == 0:
+        regions = ConnectedComponents(mask)
+        if len(regions) == 0:
             return mask
-        values = np.linspace(70,190,num_regions)
-        re_mask = np.zeros_like(mask)
-        for i in range(len(rps)):
-            re_mask[tuple(rps[i].coords.T)] = values[i]
-        return re_mask
+        return regions.Colored(mask.dtype)
     
-    def TemperatureDistributionCalc(self, frame, mask):
-        temp_frame = frame.copy()
-        temp_mask = np.where(mask>0.2, 1, 0)
-        mask_frame = temp_frame*temp_mask
-        distri_x = (np.sum(mask_frame, axis = 0))
+    def TemperatureDistributionCalc(self, frame, mask, x_offset = 0, width = None):
+        # frame and mask can be crops starting at column x_offset of a frame with width columns.
+        mask_frame = np.where(mask>0.2, frame, 0).astype(frame.dtype)
+        column_sum = np.sum(mask_frame, axis = 0)
+        if width is None:
+            width = len(column_sum)
+        distri_x = np.zeros(width, column_sum.dtype)
+        distri_x[x_offset:x_offset+len(column_sum)] = column_sum
         
         bins_x = np.linspace(0.0,float(len(distri_x)), len(distri_x))
         return distri_x, bins_x, mask_frame
     
-    def CandidateCount_x(self, hist, num_user_bound):
-        nonzero_index = np.nonzero(hist)
-        first_nonzero_index = nonzero_index[0][0]
-        last_nonzero_index = nonzero_index[0][-1]
-        hist_no_zero = hist[first_nonzero_index:last_nonzero_index+1]
-        hist_no_zero = hist_no_zero/ np.max(hist_no_zero)
-        height = np.mean(hist_no_zero)
-        fs = len(hist_no_zero)
-        fc = num_user_bound  
-        try:
-            w = fc / (fs / 2) 
-            b, a = signal.butter(5, w, 'low')
-            filtered = signal.filtfilt(b, a, hist_no_zero)
-        except:
+    def LowPassFilter(self, hists, num_user_bound):
+        # filtering the histograms (the last axis) with the same length, the cutoff is halved when the filtering fails.
+        fs = np.shape(hists)[-1]
+        cutoffs = [num_user_bound, num_user_bound / 2, num_user_bound / 4]
+        for i, fc in enumerate(cutoffs):
             try:
-                fc = num_user_bound / 2
-                w = fc / (fs / 2) 
-                b, a = signal.butter(5, w, 'low')
-                filtered = signal.filtfilt(b, a, hist_no_zero)
-            except:
-                fc = num_user_bound / 4
-                w = fc / (fs / 2) 
-                b, a = signal.butter(5, w, 'low')
-                filtered = signal.filtfilt(b, a, hist_no_zero)
-        peaks, _ = signal.find_peaks(filtered, height, prominence=0.1)
-        peaks_in_hist = peaks + first_nonzero_index
-        return peaks_in_hist, peaks, hist_no_zero, filtered
+                b, a = ButterworthLowPass(fs, fc)
+                return signal.filtfilt(b, a, hists)
+            except Exception:
+                if i == len(cutoffs) - 1:
+                    raise
+    
+    def CandidateCount_x(self, hist, num_user_bound):
+        return self.CandidateCountBatch([hist], num_user_bound)[0]
+    
+    def CandidateCountBatch(self, hists, num_user_bound):
+        """counting the candidate users (peaks) in the column histograms of all regions of a frame
+
+        Args:
+            hists (list): the column histograms.
+            num_user_bound (int): the cutoff of the low pass filter.
+
+        Returns:
+            list: (peaks_in_hist, peaks, hist_no_zero, filtered) of each histogram.
+        """
+        hists_no_zero = []
+        first_nonzero_indexes = []
+        for hist in hists:
+            nonzero_index = np.nonzero(hist)
+            first_nonzero_index = nonzero_index[0][0]
+            last_nonzero_index = nonzero_index[0][-1]
+            hist_no_zero = hist[first_nonzero_index:last_nonzero_index+1]
+            hists_no_zero.append(hist_no_zero/ np.max(hist_no_zero))
+            first_nonzero_indexes.append(first_nonzero_index)
+        
+        # the histograms with the same length are filtered together
+        same_length = defaultdict(list)
+        for index, hist_no_zero in enumerate(hists_no_zero):
+            same_length[len(hist_no_zero)].append(index)
+        filtered = [None for i in range(len(hists))]
+        for indexes in same_length.values():
+            filtered_hists = self.LowPassFilter(np.array([hists_no_zero[index] for index in indexes]), num_user_bound)
+            for index, filtered_hist in zip(indexes, filtered_hists):
+                filtered[index] = filtered_hist
+        
+        results = []
+        for index, hist_no_zero in enumerate(hists_no_zero):
+            height = np.mean(hist_no_zero)
+            peaks, _ = signal.find_peaks(filtered[index], height, prominence=0.1)
+            peaks_in_hist = peaks + first_nonzero_indexes[index]
+            results.append((peaks_in_hist, peaks, hist_no_zero, filtered[index]))
+        return results
     
     def MultiOtsu(self,hist, num_classes):
         if num_classes<2:
             return []
-        if num_classes>4: 
-            original_distri_x = list(hist[0])
-            original_bins_x = list(hist[1])
-            # downsample the histogram
-            distri_x = original_distri_x[::5]
-            bins_x = original_bins_x[::5]
-            hist_new = (np.array(distri_x), np.array(bins_x))
-            thresholds = threshold_multiotsu(image=None, classes= num_classes, hist=hist_new)
-        else:
-            thresholds = threshold_multiotsu(image=None, classes= num_classes, hist=hist)
-        return thresholds
-
-    def CuttingEdage(self, mask_frame, original_mask, threshold_x, stride = 0.8, lambda_x = 0.6):
-        Y_dim, X_dim = mask_frame.shape
-        mask_2 = np.ones_like(mask_frame)
-        initial_cutting_edges_x = []
-        for t in threshold_x:
-            t = int(t)
-            edge = [t for i in range(Y_dim)]
-            initial_cutting_edges_x.append(edge)
-        
-        updated_cutting_edges_x = []
-        for index, e_x in enumerate(initial_cutting_edges_x):
-            temp_edge = []
-            last_drift = 0
-            last_cut_pt = e_x[0]
-            for row in range(Y_dim):
-                x_left = max(e_x[row]-20, 0)
-                x_right = min(e_x[row] + 20, X_dim)
-                left_mean = np.mean(mask_frame[row, x_left:e_x[row]])
-                right_mean = np.mean(mask_frame[row, e_x[row]:x_right])
-                diff = left_mean - right_mean
-                drift = lambda_x * diff + (1-lambda_x) * last_drift
-                current_cut_pt = int(drift*stride + e_x[row])
-                temp_edge.append(current_cut_pt)
-                if current_cut_pt < last_cut_pt:
-                    mask_2[row, current_cut_pt:last_cut_pt+1] = 0
-                else:
-                    mask_2[row, last_cut_pt: current_cut_pt+1] = 0
-                last_cut_pt = current_cut_pt
-                last_drift = drift
-            updated_cutting_edges_x.append(temp_edge)
+        # exact at the full resolution of the histogram, also for more than 4 classes
+        return MultiOtsuThresholds(hist[0], hist[1], num_classes)
+
+    def CuttingEdage(self, mask_frame, original_mask, threshold_x, stride = 0.8, lambda_x = 0.6, x_offset = 0, width = None):
+        # mask_frame and original_mask can be crops starting at column x_offset of a frame with width columns, the crop
+        # has to contain the 20 pixels windows beside the thresholds. The cutting edges are in the frame coordinates.
+        mask_2 = DriftCuttingMask(mask_frame, threshold_x, stride, lambda_x, x_offset, width)
         return mask_2 * original_mask
     
     
-    def Forward(self, frame):
-        """processing
+    def FindRegions(self, frame):
+        """finding the candidate regions before splitting them
 
         Args:
             frame (numpy.array): the output of the BaseProcess
 
         Returns:
-            numpy.array: masks of all steps that contain the region of interests (ROIs)
+            ConnectedComponents, numpy.array: the regions and their mask
         """
         expansion_coeff = self.expansion_coefficient*self.expansion_coefficient
         box_size = (int(expansion_coeff * self.valid_region_area_limit)//2)*2 +1 # the box_size must be odd.
         maximum = 255
-        mask = self.AdaptiveBinary(frame, maximum, box_size)
-        mask2 = self.BorderRemove(mask)
+        with instrumentation.Stage("adaptive_binary"):
+            mask = self.AdaptiveBinary(frame, maximum, box_size)
+        with instrumentation.Stage("border_blob_remove"):
+            # one labeling pass for the border removing, the blob removing and the region dividing
+            pixel_limit = expansion_coeff * self.valid_region_area_limit
+            regions = self.AreaFilter(self.BorderFilter(ConnectedComponents(mask)), pixel_limit)
+            mask3 = regions.Mask(255, mask.dtype)
+        instrumentation.Count("regions", len(regions))
+        return regions, mask3
+    
+    def CoarseRegions(self, frame):
+        """finding the candidate regions at the coarse expansion ratio and their masks at the full resolution
+
+        The border and blob removing run on the coarse mask. Inside the window of every coarse region, the frame is
+        thresholded at the full resolution with the upsampled threshold surface, and the components that overlap the
+        coarse region make the region mask.
+
+        Args:
+            frame (numpy.array): the output of the BaseProcess
+
+        Returns:
+            list, numpy.array: (rows, columns, mask) of the regions at the full resolution and the mask of all regions
+        """
+        H, W = frame.shape
+        downscale = max(int(round(self.expansion_coefficient / self.coarse_expansion_coefficient)), 1)
+        expansion_coeff = self.expansion_coefficient*self.expansion_coefficient
+        box_size = (int(expansion_coeff * self.valid_region_area_limit)//2)*2 +1
         pixel_limit = expansion_coeff * self.valid_region_area_limit
-        mask3 = self.BlobRemove(mask2, pixel_limit)
+        with instrumentation.Stage("adaptive_binary"):
+            small, surface = self.ThresholdSurface(frame, box_size, downscale)
+            coarse_mask = np.where(small > np.rint(surface), 255, 0).astype(np.uint8)
+        with instrumentation.Stage("border_blob_remove"):
+            regions = self.AreaFilter(self.BorderFilter(ConnectedComponents(coarse_mask)), pixel_limit / (downscale*downscale))
+        instrumentation.Count("regions", len(regions))
+        
+        Hc, Wc = coarse_mask.shape
+        surface = cv2.resize(surface, (Wc * downscale, Hc * downscale), interpolation = cv2.INTER_LINEAR)
+        mask3 = np.zeros((H, W), np.uint8)
+        crops = []
+        for i in range(len(regions)):
+            # the window is one coarse pixel larger than the bbox, the last coarse row and column reach the frame border
+            coarse_rows, coarse_columns = regions.Slices(i, margin = 1)
+            rows = slice(coarse_rows.start * downscale, H if coarse_rows.stop == Hc else coarse_rows.stop * downscale)
+            columns = slice(coarse_columns.start * downscale, W if coarse_columns.stop == Wc else coarse_columns.stop * downscale)
+            row_index = np.minimum(np.arange(rows.start, rows.stop), Hc * downscale - 1)
+            column_index = np.minimum(np.arange(columns.start, columns.stop), Wc * downscale - 1)
+            binary = frame[rows, columns] > np.rint(surface[np.ix_(row_index, column_index)])
+            coarse_region = regions.RegionMask(i, (coarse_rows, coarse_columns), bool)
+            coarse_region = coarse_region[np.ix_(np.minimum(row_index // downscale, Hc - 1) - coarse_rows.start, np.minimum(column_index // downscale, Wc - 1) - coarse_columns.start)]
+            components = ConnectedComponents(binary)
+            overlapped = np.isin(components.ids, components.labels[coarse_region & binary])
+            m = components.Select(overlapped).Mask(1, np.uint8)
+            ys, xs = np.nonzero(m)
+            if len(ys) == 0:
+                continue
+            m = m[ys.min():ys.max()+1, xs.min():xs.max()+1]
+            rows = slice(rows.start + ys.min(), rows.start + ys.max() + 1)
+            columns = slice(columns.start + xs.min(), columns.start + xs.max() + 1)
+            mask3[rows, columns] = np.maximum(mask3[rows, columns], m * 255)
+            crops.append((rows, columns, m))
+        return crops, mask3
+    
+    def RegionDistributions(self, frame, crops):
+        # the column temperature distributions of the regions (rows, columns, mask) and their candidate users (peaks)
+        W = frame.shape[1]
+        with instrumentation.Stage("peak_otsu_split"):
+            distributions = []
+            for rows, columns, m in crops:
+                distributions.append(self.TemperatureDistributionCalc(frame[rows, columns], m, columns.start, W))
+            candidates = self.CandidateCountBatch([distri_x for distri_x, _, _ in distributions], 20)
+        return distributions, candidates
+    
+    def Forward(self, frame):
+        """processing
+
+        Args:
+            frame (numpy.array): the output of the BaseProcess
+
+        Returns:
+            numpy.array: masks of all steps that contain the region of interests (ROIs)
+        """
+        if self.coarse_expansion_coefficient is None:
+            regions, mask3 = self.FindRegions(frame)
+            crops = regions.Crops(mask3.dtype)
+        else:
+            crops, mask3 = self.CoarseRegions(frame)
         
         re_mask = np.zeros_like(mask3)
-        masks = self.RegionDivid(mask3)
-        for m in masks:
-            distri_x, bins_x, mask_frame = self.TemperatureDistributionCalc(frame, m)
-            
-            peaks_x, _ , _, _ = self.CandidateCount_x(distri_x, 20) 
-            
-            if len(peaks_x) == 0:
-                thresholds_x = []
-            else:
-                thresholds_x = self.MultiOtsu((distri_x,bins_x), num_classes = len(peaks_x))
+        W = mask3.shape[1]
+        distributions, candidates = self.RegionDistributions(frame, crops)
+        for i_r, (rows, columns, m) in enumerate(crops):
+            with instrumentation.Stage("region_otsu_split"):
+                distri_x, bins_x, mask_frame = distributions[i_r]
+                peaks_x, _ , _, _ = candidates[i_r]
+                
+                if len(peaks_x) == 0:
+                    thresholds_x = []
+                else:
+                    thresholds_x = self.MultiOtsu((distri_x,bins_x), num_classes = len(peaks_x))
             
-            mask1 = self.CuttingEdage(mask_frame, m, thresholds_x, stride = 0.4, lambda_x = 0.4)
-            mask2 = self.TopKRegion(mask1, topk = (len(thresholds_x) + 1))
-            re_mask = re_mask + mask2
-        re_mask = np.where(re_mask>0.2, 255, 0)    
+            with instrumentation.Stage("cutting"):
+                if len(thresholds_x) > 0:
+                    # widening the crop to the windows beside the thresholds
+                    window = slice(max(min(columns.start, int(min(thresholds_x)) - 20), 0), min(max(columns.stop, int(max(thresholds_x)) + 20), W))
+                    window_mask = np.zeros((m.shape[0], window.stop - window.start), m.dtype)
+                    window_mask[:, columns.start - window.start:columns.stop - window.start] = m
+                    m, columns = window_mask, window
+                    mask_frame = np.where(m>0.2, frame[rows, columns], 0).astype(frame.dtype)
+                mask1 = self.CuttingEdage(mask_frame, m, thresholds_x, stride = 0.4, lambda_x = 0.4, x_offset = columns.start, width = W)
+                mask2 = self.TopKRegion(mask1, topk = (len(thresholds_x) + 1))
+            re_mask[rows, columns] = np.maximum(re_mask[rows, columns], mask2)
+        re_mask = np.where(re_mask>0.2, 255, 0).astype(np.uint8)
+        if self.lean:
+            return mask3, re_mask, None, None
         
         img = re_mask.copy()
-        img = np.array(img, np.uint8)
         try:
             contours,hierarchy = cv2.findContours(img,cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         except:
@@ -468,10 +1128,84 @@ class DetectingProcess():
         return mask3, re_mask, re_mask_colored, bounding_boxes
 
 # second component: considering the temporal information
+# The detector of every worker process of ParallelDetectingProcess
+detecting_worker = None
+
+def InitDetectingWorker(args):
+    global detecting_worker
+    detecting_worker = DetectingProcess(*args)
+
+def DetectingWorkerForward(frame):
+    return detecting_worker.Forward(frame)
+
+
+class ParallelDetectingProcess():
+    """DetectingProcess.Forward of the frames of a recording on a process pool.
+
+    DetectingProcess.Forward has no temporal state, so the frames can be detected in any order and the outputs are
+    the same as the sequential ones. The outputs are fed to TrackingDetectingMergeProcess.Forward(..., detection=...)
+    in the order of the frames.
+    """
+    def __init__(self, expansion_coefficient = 20, valid_region_area_limit = 5, threshold_downscale = 1, coarse_expansion_coefficient = None, lean = False, processes = None, chunksize = 4) -> None:
+        """Initailization
+
+        Args:
+            expansion_coefficient, valid_region_area_limit, threshold_downscale, coarse_expansion_coefficient, lean: the arguments of DetectingProcess
+            processes (int, optional): the number of worker processes. Defaults to None (the number of CPUs).
+            chunksize (int, optional): the number of frames sent to a worker at once. Defaults to 4.
+        """
+        args = (expansion_coefficient, valid_region_area_limit, threshold_downscale, coarse_expansion_coefficient, lean)
+        self.chunksize = chunksize
+        self.executor = concurrent.futures.ProcessPoolExecutor(processes, initializer=InitDetectingWorker, initargs=(args,))
+
+    def Forward(self, frames, valid = None):
+        """detecting a batch of frames
+
+        Args:
+            frames (numpy.array): the processed images (N,H,W), e.g. the ira_img of PrePipeline.ForwardBatch
+            valid (numpy.array, optional): the validity mask (N,), the invalid frames are not detected. Defaults to None (all valid).
+
+        Returns:
+            list: the outputs of DetectingProcess.Forward of every frame, None for the invalid frames
+        """
+        if valid is None:
+            valid = np.ones(len(frames), bool)
+        indices = np.flatnonzero(valid)
+        detections = [None] * len(frames)
+        with instrumentation.Stage("parallel_detection"):
+            outputs = self.executor.map(DetectingWorkerForward, [frames[index] for index in indices], chunksize=self.chunksize)
+            for index, output in zip(indices, outputs):
+                detections[index] = output
+        return detections
+
+    def Close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+
+
 class TrackingProcess():
-    def __init__(self) -> None:
+    uses_frame = True  # the trackers are updated on the JET colour mapped frame
+    
+    def __init__(self, threads = None) -> None:
+        """Initailization
+
+        Args:
+            threads (int, optional): updating the trackers concurrently on a pool of this many threads, OpenCV releases
+                the GIL inside the KCF update. It is opt-in: on one CPU it is ~2% slower than the serial updates, the gain
+                on several cores is not measured yet (benchmark.py trackerthreads). Close releases the threads.
+                Defaults to None (one after another).
+        """
         self.trackers = []
         self.timers = []
+        self.ids = []  # the persistent id of every tracker, increasing in the creation order
+        self.next_id = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads) if threads is not None and threads > 1 else None
     
     def CreatTracker(self,frame, initBB):
         # print("Before creating traker, No. of tracker: ", len(self.trackers))
@@ -479,13 +1213,19 @@ class TrackingProcess():
         tracker.init(frame, initBB)
         self.trackers.append(tracker)
         self.timers.append(0)
+        self.ids.append(self.next_id)
+        self.next_id += 1
+        instrumentation.Count("trackers_created")
         # print("After creating traker, No. of tracker: ", len(self.trackers))
+        return self.ids[-1]
         
     def DeleteTracker(self,tracker_index):
         # print("No. of Tracker: ", len(self.trackers))
         if tracker_index < len(self.trackers):
             del self.trackers[tracker_index]
             del self.timers[tracker_index]
+            del self.ids[tracker_index]
+            instrumentation.Count("trackers_deleted")
             return 1
         return 0
 
@@ -505,66 +1245,241 @@ class TrackingProcess():
     def GetTrackersNum(self):
         return len(self.trackers)
     
-    def Forward(self, frame):
+    def Forward(self, frame, detected_bboxes = None):
+        # detected_bboxes is not used by the KCF trackers
         states = []
         timers = []
         return_bboxs = []
-        for index,tracker in enumerate(self.trackers):
-            state, bbox = tracker.update(frame) 
-            self.timers[index] += 1
-            states.append(state)
-            timers.append(self.timers[index])
-            return_bboxs.append(bbox)    
+        with instrumentation.Stage("kcf_update"):
+            if self.executor is not None and len(self.trackers) > 1:
+                # map keeps the order of the trackers
+                updates = list(self.executor.map(lambda tracker: tracker.update(frame), self.trackers))
+            else:
+                updates = [tracker.update(frame) for tracker in self.trackers]
+            for index, (state, bbox) in enumerate(updates):
+                self.timers[index] += 1
+                states.append(state)
+                timers.append(self.timers[index])
+                return_bboxs.append(bbox)    
         return states, return_bboxs, timers
+    
+    def Close(self):
+        # shutting down the threads of the concurrent updates
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
         
 
+def BBoxIoUMatrix(bboxes1, bboxes2):
+    # the IoUs between every (x, y, w, h) of bboxes1 and of bboxes2, (len(bboxes1), len(bboxes2))
+    b1 = np.reshape(np.asarray(bboxes1, np.float64), (-1, 1, 4))
+    b2 = np.reshape(np.asarray(bboxes2, np.float64), (1, -1, 4))
+    w = np.clip(np.minimum(b1[..., 0] + b1[..., 2], b2[..., 0] + b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0]), 0, None)
+    h = np.clip(np.minimum(b1[..., 1] + b1[..., 3], b2[..., 1] + b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1]), 0, None)
+    intersection = w * h
+    union = b1[..., 2] * b1[..., 3] + b2[..., 2] * b2[..., 3] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class BBoxTrackingProcess():
+    """The bbox only alternative of TrackingProcess.
+
+    Every track is a constant velocity Kalman filter of its bbox centre and size. On every frame the tracks are
+    predicted and associated with the detected bboxes by the Hungarian assignment of the IoU and centroid distance
+    cost. The tracks have the same interface as the KCF trackers, so the merge logic is the same.
+    """
+    uses_frame = False  # the tracks only need the detected bboxes
+    
+    def __init__(self, iou_threshold = 0.1, centroid_gate = 80, max_coast_frames = 3) -> None:
+        """Initailization
+
+        Args:
+            iou_threshold (float, optional): the lowest IoU of a match. Defaults to 0.1.
+            centroid_gate (int, optional): the largest centre distance (pixels) of a match without overlap. Defaults to 80.
+            max_coast_frames (int, optional): the most successive frames without a match before the track is lost. Defaults to 3.
+        """
+        if KalmanFilter is None:
+            raise ImportError("BBoxTrackingProcess requires filterpy")
+        self.iou_threshold = iou_threshold
+        self.centroid_gate = centroid_gate
+        self.max_coast_frames = max_coast_frames
+        self.trackers = []
+        self.timers = []
+        self.coasts = []
+        self.ids = []  # the persistent id of every track, increasing in the creation order
+        self.next_id = 0
+    
+    def InitFilter(self, initBB):
+        # the state is (cx, cy, w, h) and their velocities
+        x, y, w, h = initBB
+        kf = KalmanFilter(dim_x=8, dim_z=4)
+        kf.F = np.eye(8)
+        kf.F[:4, 4:] = np.eye(4)
+        kf.H = np.eye(4, 8)
+        kf.R *= 25.0
+        kf.P[4:, 4:] *= 1000.0
+        kf.P *= 10.0
+        kf.Q[4:, 4:] *= 0.01
+        kf.x[:4, 0] = (x + w / 2, y + h / 2, w, h)
+        return kf
+    
+    def FilterBBox(self, kf, shape = None):
+        # the bbox of the filter state, clipped to the frame of shape (H, W)
+        cx, cy, w, h = kf.x[:4, 0]
+        x, y = cx - max(w, 1.0) / 2, cy - max(h, 1.0) / 2
+        x2, y2 = x + max(w, 1.0), y + max(h, 1.0)
+        if shape is not None:
+            x, y = min(max(x, 0.0), shape[1] - 1.0), min(max(y, 0.0), shape[0] - 1.0)
+            x2, y2 = min(max(x2, x + 1.0), float(shape[1])), min(max(y2, y + 1.0), float(shape[0]))
+        return (x, y, x2 - x, y2 - y)
+    
+    def CreatTracker(self, frame, initBB):
+        self.trackers.append(self.InitFilter(initBB))
+        self.timers.append(0)
+        self.coasts.append(0)
+        self.ids.append(self.next_id)
+        self.next_id += 1
+        instrumentation.Count("trackers_created")
+        return self.ids[-1]
+    
+    def DeleteTracker(self, tracker_index):
+        if tracker_index < len(self.trackers):
+            del self.trackers[tracker_index]
+            del self.timers[tracker_index]
+            del self.coasts[tracker_index]
+            del self.ids[tracker_index]
+            instrumentation.Count("trackers_deleted")
+            return 1
+        return 0
+    
+    def ReplaceTracker(self, tracker_index, frame, initBB):
+        if tracker_index < len(self.trackers):
+            self.trackers[tracker_index] = self.InitFilter(initBB)
+            self.timers[tracker_index] += 1
+            self.coasts[tracker_index] = 0
+        else:
+            return 0
+    
+    def GetTrackersNum(self):
+        return len(self.trackers)
+    
+    def Associate(self, predicted_bboxes, detected_bboxes):
+        # the Hungarian assignment of the tracks to the detections, returns the (track, detection) pairs
+        if len(predicted_bboxes) == 0 or len(detected_bboxes) == 0:
+            return []
+        iou = BBoxIoUMatrix(predicted_bboxes, detected_bboxes)
+        p = np.asarray(predicted_bboxes, np.float64)
+        d = np.asarray(detected_bboxes, np.float64)
+        distance = np.hypot((p[:, None, 0] + p[:, None, 2] / 2) - (d[None, :, 0] + d[None, :, 2] / 2),
+                            (p[:, None, 1] + p[:, None, 3] / 2) - (d[None, :, 1] + d[None, :, 3] / 2))
+        cost = (1.0 - iou) + distance / self.centroid_gate
+        rows, columns = linear_sum_assignment(cost)
+        valid = (iou[rows, columns] >= self.iou_threshold) | (distance[rows, columns] <= self.centroid_gate)
+        return list(zip(rows[valid], columns[valid]))
+    
+    def Forward(self, frame, detected_bboxes = None):
+        states = []
+        timers = []
+        return_bboxs = []
+        with instrumentation.Stage("bbox_track_update"):
+            for kf in self.trackers:
+                kf.predict()
+            predicted_bboxes = [self.FilterBBox(kf, frame.shape) for kf in self.trackers]
+            matched = np.zeros(len(self.trackers), bool)
+            for index, detection in self.Associate(predicted_bboxes, detected_bboxes if detected_bboxes is not None else []):
+                x, y, w, h = detected_bboxes[detection]
+                self.trackers[index].update(np.array([x + w / 2, y + h / 2, w, h], np.float64))
+                matched[index] = True
+            for index, kf in enumerate(self.trackers):
+                self.coasts[index] = 0 if matched[index] else self.coasts[index] + 1
+                self.timers[index] += 1
+                states.append(self.coasts[index] <= self.max_coast_frames)
+                timers.append(self.timers[index])
+                return_bboxs.append(self.FilterBBox(kf, frame.shape))
+        return states, return_bboxs, timers
+    
+    def Close(self):
+        # nothing to release, the same interface as TrackingProcess
+        pass
+
+
+# The compact output of TrackingDetectingMergeProcess.Forward in the lean mode
+TrackingResult = namedtuple("TrackingResult", ["valid_BBoxes", "valid_timers", "valid_ids", "original_BBoxes", "original_timers"])
+
+
 class TrackingDetectingMergeProcess():
-    def __init__(self, expansion_coefficient = 20, valid_region_area_limit = 5, prvs_mask_buffer_size=5) -> None:
-        self.detector = DetectingProcess(expansion_coefficient, valid_region_area_limit)
-        self.tracker = TrackingProcess()
+    def __init__(self, expansion_coefficient = 20, valid_region_area_limit = 5, prvs_mask_buffer_size=5, threshold_downscale = 1, coarse_expansion_coefficient = None, activity_gate = None, tracker_backend = "kcf", tracker_threads = None, lean = False) -> None:
+        # lean: skipping the masks and the colored masks that are only visualised, Forward returns a TrackingResult
+        self.lean = lean
+        self.detector = DetectingProcess(expansion_coefficient, valid_region_area_limit, threshold_downscale, coarse_expansion_coefficient, lean)
+        # "kcf": a KCF tracker per user on the colour mapped frame, "bbox": the Kalman filtered bboxes of BBoxTrackingProcess
+        if tracker_backend == "kcf":
+            self.tracker = TrackingProcess(tracker_threads)
+        elif tracker_backend == "bbox":
+            self.tracker = BBoxTrackingProcess()
+        else:
+            raise ValueError("unknown tracker backend: %s" % tracker_backend)
         self.prvs_mask_buffer_size = prvs_mask_buffer_size
         self.prvs_mask_buffer = []
+        self.prvs_mask_count = None  # the number of the masks in prvs_mask_buffer that cover every pixel
+        self.activity_gate = activity_gate  # an ActivityGate, None runs the detection on every frame
+        self.previous_outputs = None
+        self.tracks = {}  # track id -> (bbox, timer) of the valid tracks of the last frame
+        self.track_centers = {}  # (row, column) of the bbox centre -> track id
+    
+    def PushPrvsMask(self, mask):
+        # appending the mask to prvs_mask_buffer and keeping prvs_mask_count up to date
+        if self.prvs_mask_count is None:
+            self.prvs_mask_count = np.zeros(mask.shape, np.uint16)
+        self.prvs_mask_buffer.append(mask)
+        self.prvs_mask_count += mask > 0
+        if len(self.prvs_mask_buffer) > self.prvs_mask_buffer_size:
+            self.prvs_mask_count -= self.prvs_mask_buffer.pop(0) > 0
     
     def OverlappingFilter(self,current_mask):
+        # keeping the regions that overlap all the masks in prvs_mask_buffer
         overlapped_points = []
         if len(self.prvs_mask_buffer) == 0:
             return current_mask, overlapped_points
-        overlapping = current_mask.copy()
-        for prvs_mask in self.prvs_mask_buffer:
-            overlapping = prvs_mask * overlapping
-        current_labeled = label(current_mask)
-        output_mask = np.zeros_like(current_mask)
-        
-        rps = regionprops(current_labeled)
-        for i in range(len(rps)):
-            corordinates = rps[i].coords.T
-            overlapped_flag = False
-            for j in range(len(corordinates[0])):
-                x = corordinates[0][j]
-                y = corordinates[1][j]
-                if overlapping[x,y] > 0.01:
-                    overlapped_flag = True
-                    overlapped_points.append((x,y))
-                    break
-            if overlapped_flag:
-                output_mask[tuple(corordinates)] = 255
+        overlapping = (current_mask > 0) & (self.prvs_mask_count == len(self.prvs_mask_buffer))
+        regions = ConnectedComponents(current_mask)
+        overlapped = (np.bincount(regions.labels[overlapping], minlength=regions.num) > 0)[regions.ids]
+        for i in np.flatnonzero(overlapped):
+            # the first overlapped pixel of the region in the raster order
+            rows, columns = regions.Slices(i)
+            region_overlapping = (regions.labels[rows, columns] == regions.ids[i]) & overlapping[rows, columns]
+            x, y = np.unravel_index(np.argmax(region_overlapping), region_overlapping.shape)
+            overlapped_points.append((x + rows.start, y + columns.start))
+        output_mask = regions.Select(overlapped).Mask(255, current_mask.dtype)
         return output_mask, overlapped_points
     
     def FillHoles(self, mask):
         re_mask = ndi.binary_fill_holes(mask)
         return re_mask
     
-    def FindBBox(self, mask):
-        img = mask.copy()
-        img_temp = self.FillHoles(img)
-        img = np.array(img_temp, np.uint8)
-        try:
-            contours,hierarchy = cv2.findContours(img,cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        except:
-            contours = []
-        areas = [] 
-        for cnt in contours:
-            areas.append(cv2.contourArea(cnt))
+    def FindBBox(self, mask, offset = (0, 0)):
+        # offset: the (x, y) of the top left corner of mask when it is a crop
+        # The holes are filled inside the bbox of every region, a region that lies in a hole of another one is part of it.
+        regions = ConnectedComponents(mask)
+        bboxes = regions.BBoxes()
+        region_areas = regions.Areas()
+        absorbed = np.zeros(len(regions), bool)
+        areas = []
+        for i in range(len(regions)):
+            rows, columns = regions.Slices(i)
+            region = regions.RegionMask(i, (rows, columns), bool)
+            filled = self.FillHoles(region)
+            areas.append(np.count_nonzero(filled))
+            if areas[-1] > region_areas[i]:
+                inside = np.unique(regions.labels[rows, columns][filled & ~region])
+                absorbed[np.isin(regions.ids, inside)] = True
         areas_np = np.array(areas)
         sort_index = np.argsort(areas_np)
         inverse_sort_index = sort_index[::-1]
@@ -572,44 +1487,27 @@ class TrackingDetectingMergeProcess():
         bounding_boxes = []
         re_areas = []
         for index in inverse_sort_index:
-            cnt = contours[index]
-            x,y,w,h = cv2.boundingRect(cnt)
-            bounding_boxes.append((x,y,w,h))
+            if absorbed[index]:
+                continue
+            x,y,w,h = [int(v) for v in bboxes[index]]
+            bounding_boxes.append((x + offset[0],y + offset[1],w,h))
             re_areas.append(areas[index])
         
         return bounding_boxes,re_areas
     
     def RegionColored(self,mask_in):
         # Given different region with different values
-        mask = mask_in.copy()
-        mask_labeled = label(mask)
-        rps = regionprops(mask_labeled)
-        num_regions = len(rps)
-        if num_regions == 0:
-            return mask
-        values = np.linspace(70,190,num_regions)
-        re_mask = np.zeros_like(mask)
-        for i in range(len(rps)):
-            re_mask[tuple(rps[i].coords.T)] = values[i]
-        return re_mask
+        regions = ConnectedComponents(mask_in)
+        if len(regions) == 0:
+            return mask_in.copy()
+        return regions.Colored(mask_in.dtype)
     
     def RegionDivid(self, mask):
-        masks = []
-        copy_mask = mask.copy()
-        label_mask = label(copy_mask)
-        rps = regionprops(label_mask)
-        areas = [r.area for r in rps]
-        for i in range(len(rps)):
-            corordinates = rps[i].coords.T
-            temp_mask = np.zeros_like(mask)
-            temp_mask[tuple(corordinates)] = 1
-            masks.append(temp_mask)
-        return masks, areas
+        regions = ConnectedComponents(mask)
+        return regions.RegionMasks(mask.dtype), list(regions.Areas())
     
     def HorizontalCutting(self, frame, mask, bounds, stride = 0.8, lambda_y = 0.8):
-        temp_frame = frame.copy()
-        temp_mask = np.where(mask>0.2, 1, 0)
-        masked_frame = temp_frame*temp_mask
+        masked_frame = np.where(mask>0.2, frame, 0).astype(frame.dtype)
 
         Y_dim, X_dim = masked_frame.shape
         cutting_mask = np.ones_like(masked_frame)
@@ -632,130 +1530,162 @@ class TrackingDetectingMergeProcess():
         return cutting_mask
     
     def VerticalCutting(self, frame, mask, bounds, stride = 0.8, lambda_x = 0.6):
-        temp_frame = frame.copy()
-        temp_mask = np.where(mask>0.2, 1, 0)
-        masked_frame = temp_frame*temp_mask
+        masked_frame = np.where(mask>0.2, frame, 0).astype(frame.dtype)
         
-        Y_dim, X_dim = masked_frame.shape
-        mask_2 = np.ones_like(masked_frame)
-        initial_cutting_edges_x = []
+        edges = []
         for bound in bounds:
             left_bound, right_bound = bound
-            t = int((left_bound + right_bound)/2)
-            edge = [t for i in range(Y_dim)]
-            initial_cutting_edges_x.append(edge)
-        
-        updated_cutting_edges_x = []
-        for index, e_x in enumerate(initial_cutting_edges_x):
-            temp_edge = []
-            last_drift = 0
-            last_cut_pt = e_x[0]
-            for row in range(Y_dim):
-                x_left = max(e_x[row]-20, 0)
-                x_right = min(e_x[row] + 20, X_dim)
-                left_mean = np.mean(masked_frame[row, x_left:e_x[row]])
-                right_mean = np.mean(masked_frame[row, e_x[row]:x_right])
-                diff = left_mean - right_mean
-                drift = lambda_x * diff + (1-lambda_x) * last_drift
-                current_cut_pt = int(drift*stride + e_x[row])
-                temp_edge.append(current_cut_pt)
-                if current_cut_pt < last_cut_pt:
-                    mask_2[row, current_cut_pt:last_cut_pt+1] = 0
-                else:
-                    mask_2[row, last_cut_pt: current_cut_pt+1] = 0
-                last_cut_pt = current_cut_pt
-                last_drift = drift
-            updated_cutting_edges_x.append(temp_edge)
-        return mask_2
+            edges.append(int((left_bound + right_bound)/2))
+        return DriftCuttingMask(masked_frame, edges, stride, lambda_x)
     
 
     def RegionsInBox(self, mask, BBox):
         (x, y, w, h) = BBox
         InBBox_Area = mask[y:y+h, x:x+w]
         center_pt = InBBox_Area[int(h/2), int(w/2)]
-        masks,areas = self.RegionDivid(InBBox_Area)
-        return len(masks), center_pt, areas
+        regions = ConnectedComponents(InBBox_Area)
+        return len(regions), center_pt, list(regions.Areas())
       
-    def Forward(self, frame_gray):
+    def UpdateTrackRegistry(self, valid_BBoxes, valid_timers, valid_ids):
+        self.tracks = {}
+        self.track_centers = {}
+        for (x, y, w, h), timer, track_id in zip(valid_BBoxes, valid_timers, valid_ids):
+            if w == 0:
+                continue
+            self.tracks[track_id] = ((x, y, w, h), timer)
+            self.track_centers.setdefault((int(y + h/2), int(x + w/2)), track_id)
+    
+    def Outputs(self, mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes, original_timers, valid_BBoxes, valid_timers, valid_ids):
+        self.UpdateTrackRegistry(valid_BBoxes, valid_timers, valid_ids)
+        if self.lean:
+            return TrackingResult(valid_BBoxes, valid_timers, valid_ids, original_BBoxes, original_timers)
+        return mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes, original_timers, valid_BBoxes, valid_timers, valid_ids
+    
+    def Close(self):
+        # releasing the threads of the tracker
+        self.tracker.Close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+    
+    def GetTrack(self, track_id):
+        # the (bbox, timer) of the track, None if the track is not valid in the last frame
+        return self.tracks.get(track_id)
+    
+    def GetTrackAt(self, center_pt):
+        # the id of the track whose bbox centre is center_pt (row, column), None if there is none
+        return self.track_centers.get(tuple(int(v) for v in center_pt))
+    
+    def AbsentOutputs(self, frame_gray):
+        # no one is present: the trackers are deleted and the outputs are empty
+        for index in reversed(range(self.tracker.GetTrackersNum())):
+            self.tracker.DeleteTracker(index)
+        empty_mask = np.zeros_like(frame_gray)
+        if self.lean:
+            prvs_mask_colored = None
+        elif len(self.prvs_mask_buffer) == 0:
+            prvs_mask_colored = empty_mask.copy()
+        else:
+            prvs_mask_colored = self.RegionColored(self.prvs_mask_buffer[-1])
+        self.PushPrvsMask(empty_mask)
+        return self.Outputs(empty_mask, empty_mask.copy(), empty_mask.copy(), prvs_mask_colored, [], [], [], [], [])
+
+    def Forward(self, frame_gray, ira_mat = None, detection = None):
+        """detecting and tracking the users
+
+        Args:
+            frame_gray (numpy.array): the processed image (the output of PrePipeline)
+            ira_mat (TemperatureMatrix, optional): the temperature matrix of the frame, used by the activity gate. Defaults to None.
+            detection (tuple, optional): the precomputed output of DetectingProcess.Forward(frame_gray), e.g. from
+                ParallelDetectingProcess. Defaults to None (detecting here).
+
+        Returns:
+            tuple: mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes, original_timers, valid_BBoxes, valid_timers,
+            valid_ids (the persistent track ids of valid_BBoxes), or a TrackingResult in the lean mode. On a static frame, the
+            outputs of the previous frame are returned.
+        """
+        if self.activity_gate is not None and ira_mat is not None:
+            state = self.activity_gate.Forward(ira_mat)
+            if state == ActivityGate.ABSENT:
+                self.previous_outputs = self.AbsentOutputs(frame_gray)
+                return self.previous_outputs
+            if state == ActivityGate.STATIC and self.previous_outputs is not None:
+                return self.previous_outputs
+        self.previous_outputs = self.DetectTrack(frame_gray, detection)
+        return self.previous_outputs
+
+    def DetectTrack(self, frame_gray, detection = None):
         # Detecting part
-        mask, x_split_mask, x_split_mask_colored, _ = self.detector.Forward(frame_gray)
-        x_split_mask = np.where(x_split_mask>0.1, 1, 0)
+        if detection is None:
+            detection = self.detector.Forward(frame_gray)
+        mask, x_split_mask, x_split_mask_colored, _ = detection
+        x_split_mask = np.where(x_split_mask>0.1, 1, 0).astype(np.uint8)
 
         # Considering the overlapping along the time dimension
-        filtered_mask, overlapped_points = self.OverlappingFilter(x_split_mask)
-        filtered_mask = np.where(filtered_mask>0.1, 1, 0)
+        with instrumentation.Stage("overlap_filter"):
+            filtered_mask, overlapped_points = self.OverlappingFilter(x_split_mask)
+        filtered_mask = np.where(filtered_mask>0.1, 1, 0).astype(np.uint8)
         
-        if len(self.prvs_mask_buffer) == 0:
+        if self.lean:
+            prvs_mask_colored = None
+        elif len(self.prvs_mask_buffer) == 0:
             prvs_mask_colored = self.RegionColored(mask) 
         else:
             prvs_mask_colored = self.RegionColored(self.prvs_mask_buffer[-1])
         
-        self.prvs_mask_buffer.append(mask)
-        if len(self.prvs_mask_buffer) > self.prvs_mask_buffer_size:
-            self.prvs_mask_buffer.pop(0)
+        self.PushPrvsMask(mask)
 
         detected_bboxes,_ = self.FindBBox(filtered_mask)
-        filtered_mask_colored = self.RegionColored(filtered_mask)
+        filtered_mask_colored = None if self.lean else self.RegionColored(filtered_mask)
         original_timers = [0 for i in range(len(detected_bboxes))]
         valid_timers = original_timers
 
         # Tracking part
-        frame = cv2.applyColorMap(frame_gray, cv2.COLORMAP_JET)
+        frame = cv2.applyColorMap(frame_gray, cv2.COLORMAP_JET) if self.tracker.uses_frame else frame_gray
         if self.tracker.GetTrackersNum() == 0:
-            for initBB in detected_bboxes:
-                self.tracker.CreatTracker(frame, initBB)
-            return mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, detected_bboxes,original_timers, detected_bboxes, valid_timers
+            with instrumentation.Stage("bbox_resolution"):
+                valid_ids = []
+                for initBB in detected_bboxes:
+                    valid_ids.append(self.tracker.CreatTracker(frame, initBB))
+            return self.Outputs(mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, detected_bboxes,original_timers, detected_bboxes, valid_timers, valid_ids)
         else:
-            states, tracking_boxes, timers = self.tracker.Forward(frame)
+            states, tracking_boxes, timers = self.tracker.Forward(frame, detected_bboxes)
         
-        original_BBoxes = []
-        original_timers = []
-        invalid_tracking_index = []
-        valid_BBoxes = []
-        valid_timers = []
-        valid_BBoxes_center_pts = []
-        valid_box_index2tracker_index = []
-        occupied_place = np.zeros_like(filtered_mask)
-        center_pts_marker_map = np.zeros_like(filtered_mask)
-        H, W = filtered_mask.shape
-        for index, state in enumerate(states):
-            if state:
-                (x, y, w, h) = [int(v) for v in tracking_boxes[index]]
-                original_BBoxes.append((x, y, w, h))
-                original_timers.append(timers[index])
-                regions_in_box, center_pt, areas = self.RegionsInBox(filtered_mask,(x, y, w, h))
-                if regions_in_box == 1:
-                    if x < 5 and y+h > H-5:
-                        invalid_tracking_index.append(index)
-                        continue
-                    if x+w > W+5 and y+h > H+5:
-                        invalid_tracking_index.append(index)
-                        continue
-                    if center_pt > 0.1:
-                        pass
-                    else:
-                        invalid_tracking_index.append(index)
-                        continue
-                    occupied_part = occupied_place[y : y + h, x:x+w]
-                    overlapped_ratio = np.sum(occupied_part) / (h * w)
-                    # if overlapped_ratio > 0.5:
-                    #     invalid_tracking_index.append(index)
-                    #     continue
-                    occupied_place[y:y + h, x:x+w] = 1
-                    center_pts_marker_map[int(y + h/2), int(x+w/2)] = 1
-                    valid_BBoxes_center_pts.append(( int(y + h/2), int(x+w/2)))
-                    valid_BBoxes.append((x, y, w, h))
-                    valid_timers.append(timers[index])
-                    valid_box_index2tracker_index.append(index)
-                elif regions_in_box == 2:
-                    a1 = areas[0]
-                    a2 = areas[1]
-                    if a1 > a2:
-                        a_ratio = a2 / a1
-                    else:
-                        a_ratio = a1 / a2
-
-                    if a_ratio < 0.2:
+        # resolving the tracking boxes against the detected regions
+        with instrumentation.Stage("bbox_resolution"):
+            original_BBoxes = []
+            original_timers = []
+            invalid_tracking_index = []
+            valid_BBoxes = []
+            valid_timers = []
+            valid_ids = []
+            valid_BBoxes_center_pts = {}  # the bbox centre -> the index in valid_BBoxes
+            valid_box_index2tracker_index = []
+            occupied_place = np.zeros_like(filtered_mask)
+            center_pts_marker_map = np.zeros_like(filtered_mask)
+            H, W = filtered_mask.shape
+            for index, state in enumerate(states):
+                if state:
+                    (x, y, w, h) = [int(v) for v in tracking_boxes[index]]
+                    original_BBoxes.append((x, y, w, h))
+                    original_timers.append(timers[index])
+                    regions_in_box, center_pt, areas = self.RegionsInBox(filtered_mask,(x, y, w, h))
+                    if regions_in_box == 1:
+                        if x < 5 and y+h > H-5:
+                            invalid_tracking_index.append(index)
+                            continue
+                        if x+w > W+5 and y+h > H+5:
+                            invalid_tracking_index.append(index)
+                            continue
+                        if center_pt > 0.1:
+                            pass
+                        else:
+                            invalid_tracking_index.append(index)
+                            continue
                         occupied_part = occupied_place[y : y + h, x:x+w]
                         overlapped_ratio = np.sum(occupied_part) / (h * w)
                         # if overlapped_ratio > 0.5:
@@ -763,190 +1693,336 @@ class TrackingDetectingMergeProcess():
                         #     continue
                         occupied_place[y:y + h, x:x+w] = 1
                         center_pts_marker_map[int(y + h/2), int(x+w/2)] = 1
-                        valid_BBoxes_center_pts.append(( int(y + h/2), int(x+w/2)))
+                        valid_BBoxes_center_pts.setdefault(( int(y + h/2), int(x+w/2)), len(valid_BBoxes))
                         valid_BBoxes.append((x, y, w, h))
                         valid_timers.append(timers[index])
+                        valid_ids.append(self.tracker.ids[index])
                         valid_box_index2tracker_index.append(index)
+                    elif regions_in_box == 2:
+                        a1 = areas[0]
+                        a2 = areas[1]
+                        if a1 > a2:
+                            a_ratio = a2 / a1
+                        else:
+                            a_ratio = a1 / a2
+
+                        if a_ratio < 0.2:
+                            occupied_part = occupied_place[y : y + h, x:x+w]
+                            overlapped_ratio = np.sum(occupied_part) / (h * w)
+                            # if overlapped_ratio > 0.5:
+                            #     invalid_tracking_index.append(index)
+                            #     continue
+                            occupied_place[y:y + h, x:x+w] = 1
+                            center_pts_marker_map[int(y + h/2), int(x+w/2)] = 1
+                            valid_BBoxes_center_pts.setdefault(( int(y + h/2), int(x+w/2)), len(valid_BBoxes))
+                            valid_BBoxes.append((x, y, w, h))
+                            valid_timers.append(timers[index])
+                            valid_ids.append(self.tracker.ids[index])
+                            valid_box_index2tracker_index.append(index)
+                        else:
+                            invalid_tracking_index.append(index)
+                            continue
                     else:
                         invalid_tracking_index.append(index)
-                        continue
                 else:
                     invalid_tracking_index.append(index)
-            else:
-                invalid_tracking_index.append(index)
             
-        # self.tracker.DeleteTracker(index)
-                
-        masks, areas = self.RegionDivid(filtered_mask)
-        for i_m,mask_ in enumerate(masks):
-            temp_mask = mask_ * center_pts_marker_map
-            temp_occupied = mask_ * occupied_place
-            x_index, y_index = np.where(temp_mask>0)
-            mask_area = areas[i_m]
-            # if len(x_index) == 0 and np.sum(temp_occupied) < 20:
-            if len(x_index) == 0:
-                # there is no tracking box in this region
-                detected_bboxes, _ = self.FindBBox(mask_)
-                if len(detected_bboxes) == 0:
-                    continue
-                self.tracker.CreatTracker(frame,detected_bboxes[0])
-                valid_BBoxes.append(detected_bboxes[0])
-                valid_timers.append(0)
-            elif len(x_index) == 1:
-                x = x_index[0]
-                y = y_index[0]
-                detected_bboxes, box_areas = self.FindBBox(mask_)
-                if len(detected_bboxes) == 0:
-                    continue
-                detected_bbox = detected_bboxes[0]
-                detected_area = detected_bbox[2] * detected_bbox[3]
-                BBox_index = valid_BBoxes_center_pts.index((x,y))
-                tracked_bbox = valid_BBoxes[BBox_index]
-                tracked_area = tracked_bbox[2] * tracked_bbox[3]
-
-                if detected_area > 1.5*tracked_area:
-                    temp_mask = np.zeros_like(mask_)
-                    temp_mask[tracked_bbox[1]:tracked_bbox[1]+tracked_bbox[3], tracked_bbox[0]:tracked_bbox[0]+tracked_bbox[2]] = 1
-                    cutting_mask = temp_mask * mask_
-                    filtered_mask = filtered_mask * cutting_mask
-                else:
-                    try:
-                        valid_BBoxes[BBox_index] = detected_bboxes[0]
-                    except:
-                        pass
-            elif len(x_index) == 2:
-                c_x_1 = x_index[0]
-                c_y_1 = y_index[0]
-                BBox_index_1= valid_BBoxes_center_pts.index((c_x_1,c_y_1))
-                Box_1 = valid_BBoxes[BBox_index_1]
-                
-                c_x_2 = x_index[1]
-                c_y_2 = y_index[1]
-                BBox_index_2 = valid_BBoxes_center_pts.index((c_x_2,c_y_2))
-                Box_2 = valid_BBoxes[BBox_index_2]
-
-                horizontal_overlap_ratio = 0
-                vertical_cutting_bounds = []
-                if Box_1[0] < Box_2[0]:
-                    box_1_right_border = Box_1[0] + Box_1[2]
-                    horizontal_overlap_ratio = (box_1_right_border - Box_2[0]) / Box_1[2]
-                    if horizontal_overlap_ratio < 0.4:
-                        vertical_cutting_bounds.append((box_1_right_border, Box_2[0]))
-                else:
-                    box_2_right_border = Box_2[0] + Box_2[2]
-                    horizontal_overlap_ratio = (box_2_right_border - Box_1[0]) / Box_2[2]
-                    if horizontal_overlap_ratio < 0.4:
-                        vertical_cutting_bounds.append((box_2_right_border, Box_1[0]))
+            # self.tracker.DeleteTracker(index)
                 
-                if len(vertical_cutting_bounds) > 0:
-                    cutting_mask = self.VerticalCutting(frame_gray, mask_, vertical_cutting_bounds)
-                    filtered_mask = filtered_mask * cutting_mask
-                    cutting_result = mask_* cutting_mask
-                    cutting_sub_regions = self.RegionDivid(cutting_result)
-                    # print("The number of cutting areas (Horizontal): ", len(cutting_sub_regions))
-                    detected_bboxes_temp = []
-                    detected_bboxes_temp,areas_temp = self.FindBBox(cutting_result)
-                    if len(detected_bboxes_temp) < 2:
-                        # print("No replacing")
+            regions = ConnectedComponents(filtered_mask)
+            areas = regions.Areas()
+            for i_m in range(len(regions)):
+                # the region cropped by its bbox with one pixel margin, the full frame mask is only built for the cutting
+                rows, columns = regions.Slices(i_m, margin = 1)
+                mask_crop = regions.RegionMask(i_m, (rows, columns), filtered_mask.dtype)
+                temp_mask = mask_crop * center_pts_marker_map[rows, columns]
+                x_index, y_index = np.where(temp_mask>0)
+                x_index = x_index + rows.start
+                y_index = y_index + columns.start
+                mask_area = areas[i_m]
+                # if len(x_index) == 0 and np.sum(temp_occupied) < 20:
+                if len(x_index) == 0:
+                    # there is no tracking box in this region
+                    detected_bboxes, _ = self.FindBBox(mask_crop, (columns.start, rows.start))
+                    if len(detected_bboxes) == 0:
                         continue
-                    x_, y_, w_, h_ = detected_bboxes_temp[0]
-                    # if c_x_1 > x_ and c_x_1 < x_ + w_:
-                    #     tracker_index = valid_box_index2tracker_index[BBox_index_1]
-                    #     r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
-                    #     print("Replacing:", tracker_index, r1)
-                    #     tracker_index = valid_box_index2tracker_index[BBox_index_2]
-                    #     r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
-                    #     print("Replacing:", tracker_index, r2)
-                    # else:
-                    #     tracker_index = valid_box_index2tracker_index[BBox_index_1]
-                    #     r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
-                    #     print("Replacing:", tracker_index, r1)
-                    #     tracker_index = valid_box_index2tracker_index[BBox_index_2]
-                    #     r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
-                    #     print("Replacing:", tracker_index, r2)
-                else:
-                    horizontal_cutting_bounds = []
-                    up_box_index = 0
-                    if c_x_1 > c_x_2 and Box_1[1] > Box_2[1]:
-                        # valid_BBoxes.append(Box_prvs)
-                        # valid_BBoxes.append(Box_current)
-                        # print("Boxes:", Box_prvs, Box_current)
-                        horizontal_cutting_bounds.append((int(Box_2[1]), int(Box_1[1])))
-                        up_box_index = 1
-                        # print("cutting:", ((int(Box_prvs[1]),int(Box_current[1]))))
-                    elif c_x_1 < c_x_2 and Box_1[1] < Box_2[1]:
-                        horizontal_cutting_bounds.append((int(Box_1[1]), int(Box_2[1])))
-                    else:
-                        tracker_index = valid_box_index2tracker_index[BBox_index_1]
-                        invalid_tracking_index.append(tracker_index)
-                        # self.tracker.DeleteTracker(BBox_index_prvs)
-                    if len(horizontal_cutting_bounds) > 0:
-                        cutting_mask = self.HorizontalCutting(frame_gray, mask_, horizontal_cutting_bounds)
+                    valid_ids.append(self.tracker.CreatTracker(frame,detected_bboxes[0]))
+                    valid_BBoxes.append(detected_bboxes[0])
+                    valid_timers.append(0)
+                elif len(x_index) == 1:
+                    x = x_index[0]
+                    y = y_index[0]
+                    detected_bboxes, box_areas = self.FindBBox(mask_crop, (columns.start, rows.start))
+                    if len(detected_bboxes) == 0:
+                        continue
+                    detected_bbox = detected_bboxes[0]
+                    detected_area = detected_bbox[2] * detected_bbox[3]
+                    BBox_index = valid_BBoxes_center_pts[(x,y)]
+                    tracked_bbox = valid_BBoxes[BBox_index]
+                    tracked_area = tracked_bbox[2] * tracked_bbox[3]
+
+                    if detected_area > 1.5*tracked_area:
+                        mask_ = regions.RegionMask(i_m, dtype=filtered_mask.dtype)
+                        temp_mask = np.zeros_like(mask_)
+                        temp_mask[tracked_bbox[1]:tracked_bbox[1]+tracked_bbox[3], tracked_bbox[0]:tracked_bbox[0]+tracked_bbox[2]] = 1
+                        cutting_mask = temp_mask * mask_
                         filtered_mask = filtered_mask * cutting_mask
+                    else:
+                        try:
+                            valid_BBoxes[BBox_index] = detected_bboxes[0]
+                        except:
+                            pass
+                elif len(x_index) == 2:
+                    mask_ = regions.RegionMask(i_m, dtype=filtered_mask.dtype)
+                    c_x_1 = x_index[0]
+                    c_y_1 = y_index[0]
+                    BBox_index_1= valid_BBoxes_center_pts[(c_x_1,c_y_1)]
+                    Box_1 = valid_BBoxes[BBox_index_1]
+                
+                    c_x_2 = x_index[1]
+                    c_y_2 = y_index[1]
+                    BBox_index_2 = valid_BBoxes_center_pts[(c_x_2,c_y_2)]
+                    Box_2 = valid_BBoxes[BBox_index_2]
 
+                    horizontal_overlap_ratio = 0
+                    vertical_cutting_bounds = []
+                    if Box_1[0] < Box_2[0]:
+                        box_1_right_border = Box_1[0] + Box_1[2]
+                        horizontal_overlap_ratio = (box_1_right_border - Box_2[0]) / Box_1[2]
+                        if horizontal_overlap_ratio < 0.4:
+                            vertical_cutting_bounds.append((box_1_right_border, Box_2[0]))
+                    else:
+                        box_2_right_border = Box_2[0] + Box_2[2]
+                        horizontal_overlap_ratio = (box_2_right_border - Box_1[0]) / Box_2[2]
+                        if horizontal_overlap_ratio < 0.4:
+                            vertical_cutting_bounds.append((box_2_right_border, Box_1[0]))
+                
+                    if len(vertical_cutting_bounds) > 0:
+                        cutting_mask = self.VerticalCutting(frame_gray, mask_, vertical_cutting_bounds)
+                        filtered_mask = filtered_mask * cutting_mask
                         cutting_result = mask_* cutting_mask
-                        cutting_sub_regions = self.RegionDivid(cutting_result)
-                        # print("The number of cutting areas: ", len(cutting_sub_regions))
                         detected_bboxes_temp = []
                         detected_bboxes_temp,areas_temp = self.FindBBox(cutting_result)
                         if len(detected_bboxes_temp) < 2:
                             # print("No replacing")
                             continue
-                        if up_box_index == 0:
-                            tracker_index = valid_box_index2tracker_index[BBox_index_1]
-                            r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
-                            # print("Replacing:", tracker_index, r1)
-                            tracker_index = valid_box_index2tracker_index[BBox_index_2]
-                            r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
-                            # print("Replacing:", tracker_index, r2)
+                        x_, y_, w_, h_ = detected_bboxes_temp[0]
+                        # if c_x_1 > x_ and c_x_1 < x_ + w_:
+                        #     tracker_index = valid_box_index2tracker_index[BBox_index_1]
+                        #     r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
+                        #     print("Replacing:", tracker_index, r1)
+                        #     tracker_index = valid_box_index2tracker_index[BBox_index_2]
+                        #     r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
+                        #     print("Replacing:", tracker_index, r2)
+                        # else:
+                        #     tracker_index = valid_box_index2tracker_index[BBox_index_1]
+                        #     r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
+                        #     print("Replacing:", tracker_index, r1)
+                        #     tracker_index = valid_box_index2tracker_index[BBox_index_2]
+                        #     r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
+                        #     print("Replacing:", tracker_index, r2)
+                    else:
+                        horizontal_cutting_bounds = []
+                        up_box_index = 0
+                        if c_x_1 > c_x_2 and Box_1[1] > Box_2[1]:
+                            # valid_BBoxes.append(Box_prvs)
+                            # valid_BBoxes.append(Box_current)
+                            # print("Boxes:", Box_prvs, Box_current)
+                            horizontal_cutting_bounds.append((int(Box_2[1]), int(Box_1[1])))
+                            up_box_index = 1
+                            # print("cutting:", ((int(Box_prvs[1]),int(Box_current[1]))))
+                        elif c_x_1 < c_x_2 and Box_1[1] < Box_2[1]:
+                            horizontal_cutting_bounds.append((int(Box_1[1]), int(Box_2[1])))
                         else:
                             tracker_index = valid_box_index2tracker_index[BBox_index_1]
-                            r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
-                            # print("Replacing:", tracker_index, r1)
-                            tracker_index = valid_box_index2tracker_index[BBox_index_2]
-                            r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
-                            # print("Replacing:", tracker_index, r2)
-            else:
-                for i in range(len(x_index)):
-                    x = x_index[i]
-                    y = y_index[i]
-                    BBox_index = valid_BBoxes_center_pts.index((x,y))
-                    tracker_index = valid_box_index2tracker_index[BBox_index]
-                    invalid_tracking_index.append(tracker_index)
-                    valid_BBoxes[BBox_index] = (0,0,0,0)
-        # print("Before // No. tracker: " , len(self.tracker.trackers))
-        invalid_tracking_index.sort() 
-        # print("invalid_tracking_index:  ", invalid_tracking_index)
-        deleted_num = 0
-        for invalid_tracker_id in invalid_tracking_index:
-            re = self.tracker.DeleteTracker(invalid_tracker_id - deleted_num)
-            if re == 1:
-                deleted_num += 1
-        # print("deleted_num:  ", deleted_num)
-        filtered_mask_colored = self.RegionColored(filtered_mask)
-
-        # print("No. tracker: " , len(self.tracker.trackers))
+                            invalid_tracking_index.append(tracker_index)
+                            # self.tracker.DeleteTracker(BBox_index_prvs)
+                        if len(horizontal_cutting_bounds) > 0:
+                            cutting_mask = self.HorizontalCutting(frame_gray, mask_, horizontal_cutting_bounds)
+                            filtered_mask = filtered_mask * cutting_mask
+
+                            cutting_result = mask_* cutting_mask
+                            detected_bboxes_temp = []
+                            detected_bboxes_temp,areas_temp = self.FindBBox(cutting_result)
+                            if len(detected_bboxes_temp) < 2:
+                                # print("No replacing")
+                                continue
+                            if up_box_index == 0:
+                                tracker_index = valid_box_index2tracker_index[BBox_index_1]
+                                r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
+                                # print("Replacing:", tracker_index, r1)
+                                tracker_index = valid_box_index2tracker_index[BBox_index_2]
+                                r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
+                                # print("Replacing:", tracker_index, r2)
+                            else:
+                                tracker_index = valid_box_index2tracker_index[BBox_index_1]
+                                r1 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[1])
+                                # print("Replacing:", tracker_index, r1)
+                                tracker_index = valid_box_index2tracker_index[BBox_index_2]
+                                r2 = self.tracker.ReplaceTracker(tracker_index,frame, detected_bboxes_temp[0])
+                                # print("Replacing:", tracker_index, r2)
+                else:
+                    for i in range(len(x_index)):
+                        x = x_index[i]
+                        y = y_index[i]
+                        BBox_index = valid_BBoxes_center_pts[(x,y)]
+                        tracker_index = valid_box_index2tracker_index[BBox_index]
+                        invalid_tracking_index.append(tracker_index)
+                        valid_BBoxes[BBox_index] = (0,0,0,0)
+            # print("Before // No. tracker: " , len(self.tracker.trackers))
+            invalid_tracking_index.sort() 
+            # print("invalid_tracking_index:  ", invalid_tracking_index)
+            deleted_num = 0
+            for invalid_tracker_id in invalid_tracking_index:
+                re = self.tracker.DeleteTracker(invalid_tracker_id - deleted_num)
+                if re == 1:
+                    deleted_num += 1
+            # print("deleted_num:  ", deleted_num)
+            filtered_mask_colored = None if self.lean else self.RegionColored(filtered_mask)
+
+            # print("No. tracker: " , len(self.tracker.trackers))
         
-        return mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes, original_timers, valid_BBoxes, valid_timers
+        return self.Outputs(mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes, original_timers, valid_BBoxes, valid_timers, valid_ids)
 
 
 
 class ROIPooling():
-    def __init__(self,resize_shape, window_size, stride) -> None:
+    def __init__(self,resize_shape, window_size, stride, backend = "numpy") -> None:
+        """Initailization
+
+        Args:
+            resize_shape (tuple): the (width, height) that the ROI is resized to before the max pooling
+            window_size (int): the window size of the max pooling
+            stride (int): the stride of the max pooling
+            backend (str, optional): the method of Pooling, "numpy" (PoolingNumpy), "reduceat" (PoolingReduceat) or
+                "torch" (PoolingTorch). Defaults to "numpy".
+        """
         self.resize_shape = resize_shape
-        self.m = nn.MaxPool2d(window_size,stride)
+        self.window_size = window_size
+        self.stride = stride
+        self.backend = backend
+        self.m = None  # the torch.nn.MaxPool2d of PoolingTorch, torch is only imported by PoolingTorch
+        # the grid of the pooled maxima, (rows, columns)
+        self.grid = ((resize_shape[1] - window_size) // stride + 1, (resize_shape[0] - window_size) // stride + 1)
+    
+    def Pooling(self, roi):
+        if self.backend == "reduceat":
+            return self.PoolingReduceat(roi)
+        if self.backend == "torch":
+            return self.PoolingTorch(roi)
+        return self.PoolingNumpy(roi)
     
     def PoolingTorch(self, roi):
-        resized_roi = cv2.resize(roi, self.resizes_shape)
+        import torch
+        if self.m is None:
+            self.m = torch.nn.MaxPool2d(self.window_size, self.stride)
+        resized_roi = cv2.resize(roi, self.resize_shape)
         roi_tensor = torch.unsqueeze(torch.from_numpy(resized_roi), 0)
-        return self.m(roi_tensor)
+        return self.m(roi_tensor).cpu().detach().numpy()[0]
     
     def PoolingNumpy(self, roi):
-        resized_roi = cv2.resize(roi, self.resize_shape)
-        roi_tensor = torch.unsqueeze(torch.from_numpy(resized_roi), 0)
-        temp = self.m(roi_tensor)
-        return temp.cpu().detach().numpy()[0]
+        # the same maxima as PoolingTorch, the max pooling of the resized ROI without torch
+        with instrumentation.Stage("pooling"):
+            resized_roi = cv2.resize(roi, self.resize_shape)
+            rows, columns = self.grid
+            if self.window_size == self.stride:
+                windows = resized_roi[:rows * self.stride, :columns * self.stride].reshape(rows, self.stride, columns, self.stride)
+                return windows.max(axis=(1, 3))
+            windows = np.lib.stride_tricks.sliding_window_view(resized_roi, (self.window_size, self.window_size))
+            return windows[::self.stride, ::self.stride].max(axis=(-2, -1))
+    
+    def PoolingBatch(self, rois):
+        # the pooling of a list of ROIs in one pass, (n_rois, rows, columns). The ROIs are resized into one stack, which is
+        # max pooled at once, the maxima are the same as the ones of PoolingNumpy.
+        if self.backend != "numpy":
+            return np.stack([self.Pooling(roi) for roi in rois])
+        with instrumentation.Stage("pooling"):
+            width, height = self.resize_shape
+            resized_rois = np.empty((len(rois), height, width), np.result_type(*rois))
+            for index, roi in enumerate(rois):
+                if roi.dtype == resized_rois.dtype:
+                    cv2.resize(roi, self.resize_shape, dst=resized_rois[index])
+                else:
+                    resized_rois[index] = cv2.resize(roi, self.resize_shape)
+            rows, columns = self.grid
+            if self.window_size == self.stride:
+                # the maxima over the rows of the windows first, then over their columns, both on contiguous blocks
+                windows = resized_rois[:, :rows * self.stride].reshape(len(rois), rows, self.stride, width).max(axis=2)
+                windows = windows[:, :, :columns * self.stride].reshape(len(rois), rows, columns, self.stride)
+                return windows.max(axis=3)
+            windows = np.lib.stride_tricks.sliding_window_view(resized_rois, (self.window_size, self.window_size), axis=(1, 2))
+            return windows[:, ::self.stride, ::self.stride].max(axis=(-2, -1))
+    
+    def PoolingReduceat(self, roi):
+        # the maxima of the ROI in the grid of proportional blocks, without resizing. The maxima are taken over the
+        # pixels of the ROI rather than the interpolated ones, so they differ slightly from the ones of PoolingNumpy
+        # (by a few hundredths of a degree on the recordings).
+        with instrumentation.Stage("pooling"):
+            pooled = roi
+            for axis, blocks in enumerate(self.grid):
+                length = pooled.shape[axis]
+                bounds = np.arange(blocks) * length // blocks
+                if length < blocks:
+                    # an axis shorter than the grid repeats its pixels, as the resizing does
+                    pooled = np.take(pooled, bounds, axis=axis)
+                else:
+                    pooled = np.maximum.reduceat(pooled, bounds, axis=axis)
+            return pooled
+    
+class FeatureExtractor():
+    def __init__(self, roipooling, topk) -> None:
+        """Initailization
+
+        Args:
+            roipooling (ROIPooling): the ROI pooling of the ROIs
+            topk (int): the number of the highest pooled temperatures in the features, it is limited to the size of the
+                pooled ROI
+        """
+        self.roipooling = roipooling
+        self.topk = min(topk, self.roipooling.grid[0] * self.roipooling.grid[1])
     
+    def Forward(self, frames, bboxes, frame_indices = None):
+        """the estimator input of the bboxes, [the topk pooled temperatures in descending order, center x, center y]
+
+        Args:
+            frames (np.array): one temperature frame, or a stack of the temperature frames
+            bboxes (list): the bboxes (x,y,w,h)
+            frame_indices (list, optional): the index of the frame of each bbox in the stack of frames, None for one frame.
+                Defaults to None.
+
+        Returns:
+            np.array: the features, (n_rois, topk+2). The rows of the empty ROIs are NaN.
+        """
+        # the crops are views of the frames, the resizing and the pooling of all of them happen in FromROIs
+        rois = []
+        for index, (x, y, w, h) in enumerate(bboxes):
+            frame = frames if frame_indices is None else frames[frame_indices[index]]
+            rois.append(frame[int(y):int(y+h), int(x):int(x+w)])
+        return self.FromROIs(rois, bboxes)
+    
+    def FromROIs(self, rois, bboxes):
+        """the estimator input of the ROIs that have been cropped, e.g. the saved ROIs of train.py
+
+        Args:
+            rois (list): the ROIs
+            bboxes (list): the bboxes (x,y,w,h) of the ROIs
+
+        Returns:
+            np.array: the features, (n_rois, topk+2). The rows of the empty ROIs are NaN.
+        """
+        features = np.full((len(rois), self.topk + 2), np.nan)
+        valid = np.array([np.size(roi) > 0 for roi in rois], dtype=bool)
+        if not valid.any():
+            return features
+        pooled = self.roipooling.PoolingBatch([roi for roi, is_valid in zip(rois, valid) if is_valid])
+        pooled = np.reshape(pooled, (pooled.shape[0], -1)) # flatten
+        features[valid, :self.topk] = np.sort(pooled, axis=-1)[:, ::-1][:, :self.topk] # sort
+        x, y, w, h = np.reshape(np.asarray(bboxes, dtype=float), (-1, 4))[valid].T
+        features[valid, self.topk] = x + w / 2
+        features[valid, self.topk + 1] = y + h / 2
+        return features
+    
+
 """
 models:
 
@@ -7,7 +7,7 @@ import sys
 import pickle
 from tsmoothie.smoother import KalmanSmoother
 # Wir importieren DetectingProcess, da du es unten nutzt
-from functions2 import PrePipeline, TrackingDetectingMergeProcess, ROIPooling, SubpageInterpolating, DetectingProcess 
+from functions2 import PrePipeline, TrackingDetectingMergeProcess, ROIPooling, FeatureExtractor, SubpageInterpolating, DetectingProcess, ActivityGate, instrumentation
 
 # --- KONFIGURATION ---
 SERIAL_PORT = '/dev/ttyUSB0' 
@@ -61,7 +61,7 @@ def smooth_predictions(buffer, smoother, predict, max_len=10):
     smoothed_pred = smoother.smooth_data[0]
     return np.mean(smoothed_pred[-min(max_len, len(smoothed_pred)):])
 
-def main():
+def main(activity_gate = False):
     try:
         range_estimator = pickle.load(open('Models/hgbr_range2.sav', 'rb'))
     except FileNotFoundError:
@@ -76,8 +76,10 @@ def main():
     resize_dim = (640, 480)
 
     prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound, buffer_size=10, data_shape=data_shape)
-    stage1procerss = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit)
+    gate = ActivityGate(buffer_size=10) if activity_gate else None
+    stage1procerss = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit, activity_gate=gate)
     roipooling = ROIPooling((200, 400), 100, 100)
+    feature_extractor = FeatureExtractor(roipooling, topk=8)  # the topk of the training of Models/hgbr_range2.sav
     
     kalman_smoother = KalmanSmoother(component='level_trend', component_noise={'level': 0.0001, 'trend': 0.01})
     buffer_pred = {}
@@ -103,30 +105,26 @@ def main():
                     continue
 
                 # Hier wird 'mask' definiert (1. Rückgabewert)
-                mask, _, filtered_mask_colored, _, _, _, valid_BBoxes, valid_timers = stage1procerss.Forward(ira_img)
+                mask, _, filtered_mask_colored, _, _, _, valid_BBoxes, valid_timers, valid_ids = stage1procerss.Forward(ira_img, ira_mat)
                 
                 sub_interp = SubpageInterpolating(np.flip(sensor_mat, 0))
                 ira_colored = apply_color_map(sub_interp, expansion_coefficient, temperature_upper_bound, resize_dim)
 
                 depth_map = np.zeros_like(filtered_mask_colored, dtype=float)
                 
-                for idx, (x, y, w, h) in enumerate(valid_BBoxes):
-                    if not (100 < (x + w / 2) < 500):
-                        continue
-
-                    roi_t = ira_mat[y:y + h, x:x + w]
-                    pooled_roi = roipooling.PoolingNumpy(roi_t)
-                    
-                    flat_roi = pooled_roi.flatten()
-                    if len(flat_roi) < 8: continue
-                    
-                    input_data = np.concatenate([np.sort(flat_roi)[::-1][:8], [x + w / 2, y + h / 2]])
-
-                    predict_r = range_estimator.predict(input_data.reshape(1, -1))[0]
-                    if idx in buffer_pred:
-                        predict = smooth_predictions(buffer_pred[idx], kalman_smoother, predict_r)
+                # the prediction buffers of the deleted tracks are dropped
+                buffer_pred = {track_id: buffer_pred[track_id] for track_id in valid_ids if track_id in buffer_pred}
+                tracks = [(bbox, track_id) for bbox, track_id in zip(valid_BBoxes, valid_ids) if 100 < (bbox[0] + bbox[2] / 2) < 500]
+                features = feature_extractor.Forward(ira_mat, [bbox for bbox, _ in tracks])
+                for ((x, y, w, h), track_id), input_data in zip(tracks, features):
+                    if np.isnan(input_data[0]): continue
+
+                    with instrumentation.Stage("estimator_predict"):
+                        predict_r = range_estimator.predict(input_data.reshape(1, -1))[0]
+                    if track_id in buffer_pred:
+                        predict = smooth_predictions(buffer_pred[track_id], kalman_smoother, predict_r)
                     else:
-                        buffer_pred[idx] = [predict_r]
+                        buffer_pred[track_id] = [predict_r]
                         predict = predict_r
 
                     cv2.rectangle(ira_colored, (x, y), (x + w, y + h), (0, 255, 0), 2)
@@ -164,6 +162,13 @@ def main():
         ser.close()
         cv2.destroyAllWindows()
         print("Process interrupted by user")
+    if gate is not None:
+        print("Activity gate: ", gate.counts, "skipped %.1f%%" % (gate.SkipRatio() * 100))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python realtime_demo.py --profile prints the per-stage timing of the pipeline at exit
+    if '--profile' in sys.argv:
+        instrumentation.Enable()
+        instrumentation.DumpAtExit()
+    # python realtime_demo.py --gate skips the detection on the empty and static frames
+    main(activity_gate = '--gate' in sys.argv)
\ No newline at end of file
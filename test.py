@@ -101,7 +101,7 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
         ira_img, subpage_type, ira_mat = prepipeline.Forward(ira_matrix, ambient_temperature)
         if not isinstance(ira_img, (np.ndarray)):
             continue
-        mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers =  detector.Forward(ira_img)
+        mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers, valid_ids =  detector.Forward(ira_img)
         result, matched_bbox = ROIDetectionEvaluation(GT_bbox, valid_BBoxes,valid_timers, threshold=ROIevaluationThreshold)
         
         for i_box,ele in enumerate(matched_bbox):
@@ -16,7 +16,7 @@ import matplotlib.pyplot as plt
 from metrics import *
     
 
-def test(testdata_path, depth_model = None, range_model = None,range_model2=None):
+def test(testdata_path, depth_model = None, range_model = None,range_model2=None, activity_gate = False, processes = None):
     """the testing function for the detector and range/depth estimator
 
     Args:
@@ -24,6 +24,8 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
         depth_model (_type_, optional): the saved trained depth model path (all the models are in the Models/ folder). Defaults to None.
         range_model (_type_, optional): the saved trained range model path (all the models are in the Models/ folder). Defaults to None.
         range_model2 (_type_, optional): the saved trained range2 (using the same input of the depth model while output the estimated range) model path (all the models are in the Models/ folder). Defaults to None.
+        activity_gate (bool, optional): skipping the detection on the empty and static frames with an ActivityGate. Defaults to False.
+        processes (int, optional): detecting the frames of every preprocessed batch on a pool of this many processes before the sequential tracking. Defaults to None (sequential).
 
     Returns:
         dictionary: the results of the detector and the estimators.
@@ -34,7 +36,11 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
     valid_region_area_limit = 5
     ROIevaluationThreshold = 0.5
     prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
-    detector = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit)
+    preprocess_batch_size = 128 # number of frames preprocessed together by prepipeline.ForwardBatch
+    gate = ActivityGate() if activity_gate else None
+    detector = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit, activity_gate=gate, lean=True)
+    parallel_detector = ParallelDetectingProcess(expansion_coefficient, valid_region_area_limit, lean=True, processes=processes) if processes is not None else None
+    detection_batch = None
 
     # estimator configuration
     Roi_Pooling_Size = (2,4)
@@ -45,6 +51,7 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
     if topk > Roi_Pooling_Size[0] * Roi_Pooling_Size[1]:
         topk = Roi_Pooling_Size[0] * Roi_Pooling_Size[1]
     topk = Roi_Pooling_Size[0] * Roi_Pooling_Size[1]
+    feature_extractor = FeatureExtractor(roipooling, topk)
     kalman_smoother = KalmanSmoother(component='level_trend', 
                                     component_noise={'level':0.1, 'trend':0.0000001})
 
@@ -103,110 +110,146 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
             '0':[],
         }
 
-    # for sample_index in tqdm(range(testset.len())):
-    for sample_index in range(testset.len()):
-        ira_matrix, ambient_temperature, timestamps, GT_bbox, GT_depth, GT_range = testset.GetSample(sample_index)
-        ira_img, subpage_type, ira_mat = prepipeline.Forward(ira_matrix, ambient_temperature)
-        if not isinstance(ira_img, (np.ndarray)):
-            continue
-        mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers =  detector.Forward(ira_img)
-        result, matched_bbox = ROIDetectionEvaluation(GT_bbox, valid_BBoxes,valid_timers, threshold=ROIevaluationThreshold)
-        
-        for i_box,ele in enumerate(matched_bbox):
-            box, pred_box,count, id, index, IoU = ele
-            x,y,w,h = pred_box
-            if w == 0:
+    try:
+        # for sample_index in tqdm(range(testset.len())):
+        for sample_index in range(testset.len()):
+            if sample_index % preprocess_batch_size == 0:
+                # the stateless preprocessing runs for a whole batch of frames at once
+                ira_matrix_batch, ambient_temperature_batch = testset.GetBatch(sample_index, sample_index + preprocess_batch_size)
+                ira_img_batch, subpage_type_batch, ira_mat_batch, valid_batch = prepipeline.ForwardBatch(ira_matrix_batch, ambient_temperature_batch)
+                if parallel_detector is not None:
+                    # the stateless detection runs for the whole batch on the process pool
+                    detection_batch = parallel_detector.Forward(ira_img_batch, valid_batch)
+            ira_matrix, ambient_temperature, timestamps, GT_bbox, GT_depth, GT_range = testset.GetSample(sample_index)
+            if not valid_batch[sample_index % preprocess_batch_size]:
                 continue
+            ira_img = ira_img_batch[sample_index % preprocess_batch_size]
+            ira_mat = ira_mat_batch[sample_index % preprocess_batch_size]
+            detection = detection_batch[sample_index % preprocess_batch_size] if detection_batch is not None else None
+            tracking_result = detector.Forward(ira_img, ira_mat, detection)
+            valid_BBoxes, valid_timers, valid_ids = tracking_result.valid_BBoxes, tracking_result.valid_timers, tracking_result.valid_ids
+            result, matched_bbox = ROIDetectionEvaluation(GT_bbox, valid_BBoxes,valid_timers, threshold=ROIevaluationThreshold)
+            features = feature_extractor.Forward(ira_mat, [ele[1] for ele in matched_bbox]) # the estimator inputs of the matched bboxes
+        
+            for i_box,ele in enumerate(matched_bbox):
+                box, pred_box,count, id, index, IoU = ele
+                id = valid_ids[id] # the persistent track id, so that the prediction buffers of a track survive the deletion of other tracks
+                x,y,w,h = pred_box
+                if w == 0:
+                    continue
 
-            Outputs['GT_timestamps'].append(timestamps)
-            Outputs['Predicted_BBoxes'].append(pred_box)
-            Outputs['Object_IDs'].append(id)
+                Outputs['GT_timestamps'].append(timestamps)
+                Outputs['Predicted_BBoxes'].append(pred_box)
+                Outputs['Object_IDs'].append(id)
 
             
-            range_ = GT_range[index]
-            depth = GT_depth[index]
-            temp_roi = ira_mat[int(y):int(y+h), int(x):int(x+w)]
-            try:
-                pooled_roi = roipooling.PoolingNumpy(temp_roi)
-            except:
-                continue
-            flat_data = np.reshape(np.array([pooled_roi]), (1, -1))
-            sort_flat_data = np.sort(flat_data, axis=-1)[:,::-1]
-            center_pont = (x+w/2,y+h/2)
-            center_data = np.reshape(np.array([center_pont]), (1, -1))
-            depth_estimater_input = np.concatenate((sort_flat_data[:,:topk],center_data),axis=1)
+                range_ = GT_range[index]
+                depth = GT_depth[index]
+                if np.isnan(features[i_box, 0]): # empty roi
+                    continue
+                depth_estimater_input = features[i_box:i_box+1]
             
-            Outputs['frame_index'].append(sample_index)
-            Outputs['GT_range'].append(range_)
-            # range estimation
-            range_final_output = None
-            if range_model is not None:
-                predict_r = range_estimator.predict(sort_flat_data[:,:topk])
-                predict_r = predict_r[0]
-                Outputs['range_raw_prediction'].append(predict_r)
-                # range estimation postprocessing
-                if str(id) in buffer_pred_range.keys():
-                    if count == 0:
+                Outputs['frame_index'].append(sample_index)
+                Outputs['GT_range'].append(range_)
+                # range estimation
+                range_final_output = None
+                if range_model is not None:
+                    with instrumentation.Stage("estimator_predict"):
+                        predict_r = range_estimator.predict(depth_estimater_input[:,:topk])
+                    predict_r = predict_r[0]
+                    Outputs['range_raw_prediction'].append(predict_r)
+                    # range estimation postprocessing
+                    if str(id) in buffer_pred_range.keys():
+                        if count == 0:
+                            buffer_pred_range[str(id)] = []
+                            buffer_pred_range[str(id)].append(predict_r)
+                            Outputs['range_KF_smoothed_prediction'].append(predict_r)
+                            range_final_output = predict_r
+                        else:
+                            temp_predict = buffer_pred_range[str(id)] + [predict_r]
+                            buffer_pred_range[str(id)].append(predict_r)  
+                            # kalman smoother
+                            kalman_smoother.smooth(temp_predict)
+                            kf_smoothed_pred = kalman_smoother.smooth_data[0]
+                            kf_predict = kf_smoothed_pred[-1]
+                            Outputs['range_KF_smoothed_prediction'].append(kf_predict)
+                            range_final_output = kf_predict
+                    else:
                         buffer_pred_range[str(id)] = []
                         buffer_pred_range[str(id)].append(predict_r)
                         Outputs['range_KF_smoothed_prediction'].append(predict_r)
                         range_final_output = predict_r
-                    else:
-                        temp_predict = buffer_pred_range[str(id)] + [predict_r]
-                        buffer_pred_range[str(id)].append(predict_r)  
-                        # kalman smoother
-                        kalman_smoother.smooth(temp_predict)
-                        kf_smoothed_pred = kalman_smoother.smooth_data[0]
-                        kf_predict = kf_smoothed_pred[-1]
-                        Outputs['range_KF_smoothed_prediction'].append(kf_predict)
-                        range_final_output = kf_predict
-                else:
-                    buffer_pred_range[str(id)] = []
-                    buffer_pred_range[str(id)].append(predict_r)
-                    Outputs['range_KF_smoothed_prediction'].append(predict_r)
-                    range_final_output = predict_r
             
             
-            # range2 estimation, testing the second range estimator which use the same input of the depth estimator while output the estimated range
-            range2_final_output = None
-            if range_model2 is not None:
-                predict_r = range_estimator2.predict(depth_estimater_input)
-                predict_r = predict_r[0]
-                Outputs['range2_raw_prediction'].append(predict_r)
-                # range estimation postprocessing
-                if str(id) in buffer_pred_range2.keys():
-                    if count == 0:
+                # range2 estimation, testing the second range estimator which use the same input of the depth estimator while output the estimated range
+                range2_final_output = None
+                if range_model2 is not None:
+                    with instrumentation.Stage("estimator_predict"):
+                        predict_r = range_estimator2.predict(depth_estimater_input)
+                    predict_r = predict_r[0]
+                    Outputs['range2_raw_prediction'].append(predict_r)
+                    # range estimation postprocessing
+                    if str(id) in buffer_pred_range2.keys():
+                        if count == 0:
+                            buffer_pred_range2[str(id)] = []
+                            buffer_pred_range2[str(id)].append(predict_r)
+                            Outputs['range2_KF_smoothed_prediction'].append(predict_r)
+                            range2_final_output = predict_r
+                        else:
+                            temp_predict = buffer_pred_range2[str(id)] + [predict_r]
+                            buffer_pred_range2[str(id)].append(predict_r)  
+                            # kalman smoother
+                            kalman_smoother.smooth(temp_predict)
+                            kf_smoothed_pred = kalman_smoother.smooth_data[0]
+                            kf_predict = kf_smoothed_pred[-1]
+                            Outputs['range2_KF_smoothed_prediction'].append(kf_predict)
+                            range2_final_output = kf_predict
+                    else:
                         buffer_pred_range2[str(id)] = []
                         buffer_pred_range2[str(id)].append(predict_r)
                         Outputs['range2_KF_smoothed_prediction'].append(predict_r)
                         range2_final_output = predict_r
-                    else:
-                        temp_predict = buffer_pred_range2[str(id)] + [predict_r]
-                        buffer_pred_range2[str(id)].append(predict_r)  
-                        # kalman smoother
-                        kalman_smoother.smooth(temp_predict)
-                        kf_smoothed_pred = kalman_smoother.smooth_data[0]
-                        kf_predict = kf_smoothed_pred[-1]
-                        Outputs['range2_KF_smoothed_prediction'].append(kf_predict)
-                        range2_final_output = kf_predict
-                else:
-                    buffer_pred_range2[str(id)] = []
-                    buffer_pred_range2[str(id)].append(predict_r)
-                    Outputs['range2_KF_smoothed_prediction'].append(predict_r)
-                    range2_final_output = predict_r
             
                     
-            # depth estimation
-            depth_final_output = None
-            if depth_model is not None:
-                predict_d = depth_estimator.predict(depth_estimater_input)
-                predict_d = predict_d[0]
-                Outputs['GT_depth'].append(depth)
-                Outputs['depth_raw_prediction'].append(predict_d)
-                # depth estimation postprocessing
-                depth_final_output = predict_d
-                if str(id) in buffer_pred_depth.keys():
-                    if count == 0:
+                # depth estimation
+                depth_final_output = None
+                if depth_model is not None:
+                    with instrumentation.Stage("estimator_predict"):
+                        predict_d = depth_estimator.predict(depth_estimater_input)
+                    predict_d = predict_d[0]
+                    Outputs['GT_depth'].append(depth)
+                    Outputs['depth_raw_prediction'].append(predict_d)
+                    # depth estimation postprocessing
+                    depth_final_output = predict_d
+                    if str(id) in buffer_pred_depth.keys():
+                        if count == 0:
+                            buffer_pred_depth[str(id)] = []
+                            buffer_pred_WH[str(id)] = []
+                            buffer_pred_depth[str(id)].append(predict_d)
+                            buffer_pred_WH[str(id)].append([w,h])
+                            Outputs['depth_KF_smoothed_prediction'].append(predict_d)
+                            Outputs['depth_Size_based_predictioins'].append([predict_d for i in range(buffer_size)])
+                            depth_final_output = predict_d
+                            buffer_pred_depth_final[str(id)] = []
+                            buffer_pred_depth_final[str(id)].append(depth_final_output)
+                            Outputs['depth_KF_smoothed_Size_based_predictioins'].append(depth_final_output)                        
+                        else:
+                            temp_predict = buffer_pred_depth[str(id)] + [predict_d]
+                            buffer_pred_depth[str(id)].append(predict_d)
+                            buffer_pred_WH[str(id)].append([w,h])
+                        
+                            kalman_smoother.smooth(temp_predict)
+                            kf_smoothed_pred = kalman_smoother.smooth_data[0]
+                            kf_predict = kf_smoothed_pred[-1]
+                        
+                            Outputs['depth_KF_smoothed_prediction'].append(kf_predict)
+                            size_based_predictions = SizeBasedDepthPredection(kf_smoothed_pred, buffer_pred_WH[str(id)], buffer_size)
+                            Outputs['depth_Size_based_predictioins'].append(size_based_predictions)
+                            # add kf_predict to the list: size_based_predictions at the start
+                            temp_predict_list = [kf_predict] + size_based_predictions
+                            depth_final_output,_ = discard_outliers_and_find_expectation(np.array(temp_predict_list))
+                            Outputs['depth_KF_smoothed_Size_based_predictioins'].append(depth_final_output)
+                    else:
                         buffer_pred_depth[str(id)] = []
                         buffer_pred_WH[str(id)] = []
                         buffer_pred_depth[str(id)].append(predict_d)
@@ -216,49 +259,36 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
                         depth_final_output = predict_d
                         buffer_pred_depth_final[str(id)] = []
                         buffer_pred_depth_final[str(id)].append(depth_final_output)
-                        Outputs['depth_KF_smoothed_Size_based_predictioins'].append(depth_final_output)                        
-                    else:
-                        temp_predict = buffer_pred_depth[str(id)] + [predict_d]
-                        buffer_pred_depth[str(id)].append(predict_d)
-                        buffer_pred_WH[str(id)].append([w,h])
-                        
-                        kalman_smoother.smooth(temp_predict)
-                        kf_smoothed_pred = kalman_smoother.smooth_data[0]
-                        kf_predict = kf_smoothed_pred[-1]
-                        
-                        Outputs['depth_KF_smoothed_prediction'].append(kf_predict)
-                        size_based_predictions = SizeBasedDepthPredection(kf_smoothed_pred, buffer_pred_WH[str(id)], buffer_size)
-                        Outputs['depth_Size_based_predictioins'].append(size_based_predictions)
-                        # add kf_predict to the list: size_based_predictions at the start
-                        temp_predict_list = [kf_predict] + size_based_predictions
-                        depth_final_output,_ = discard_outliers_and_find_expectation(np.array(temp_predict_list))
                         Outputs['depth_KF_smoothed_Size_based_predictioins'].append(depth_final_output)
-                else:
-                    buffer_pred_depth[str(id)] = []
-                    buffer_pred_WH[str(id)] = []
-                    buffer_pred_depth[str(id)].append(predict_d)
-                    buffer_pred_WH[str(id)].append([w,h])
-                    Outputs['depth_KF_smoothed_prediction'].append(predict_d)
-                    Outputs['depth_Size_based_predictioins'].append([predict_d for i in range(buffer_size)])
-                    depth_final_output = predict_d
-                    buffer_pred_depth_final[str(id)] = []
-                    buffer_pred_depth_final[str(id)].append(depth_final_output)
-                    Outputs['depth_KF_smoothed_Size_based_predictioins'].append(depth_final_output)
         
-        TP, FP, FN =  result
-        TruePositive.append(TP)
-        FalsePositive.append(FP)
-        FalseNegtive.append(FN)
-        Outputs['ira_matrix'].append(ira_matrix)
+            TP, FP, FN =  result
+            TruePositive.append(TP)
+            FalsePositive.append(FP)
+            FalseNegtive.append(FN)
+            Outputs['ira_matrix'].append(ira_matrix)
+    finally:
+        # the process pool is shut down even if a frame fails
+        if parallel_detector is not None:
+            parallel_detector.Close()
 
     Outputs['TruePositive'] = TruePositive
     Outputs['FalsePositive'] = FalsePositive
     Outputs['FalseNegtive'] = FalseNegtive
+    if gate is not None:
+        Outputs['activity_gate_counts'] = dict(gate.counts)
 
     return Outputs
 
         
 if __name__ == "__main__":
+    # python test_neu.py --profile prints the per-stage timing of the pipeline at exit
+    if '--profile' in sys.argv:
+        instrumentation.Enable()
+        instrumentation.DumpAtExit()
+    # python test_neu.py --gate skips the detection on the empty and static frames
+    activity_gate = '--gate' in sys.argv
+    # python test_neu.py --processes 16 runs the detection of every batch on 16 processes
+    processes = int(sys.argv[sys.argv.index('--processes') + 1]) if '--processes' in sys.argv else None
     test_file_pathes = [
     'Dataset/Bathroom1_0_sensor_1.pickle',
     'Dataset/Bathroom1_0_sensor_4.pickle',
@@ -515,7 +545,7 @@ if __name__ == "__main__":
             testdata_path = [file_name,]
             
             # Führe den Test durch
-            output = test(testdata_path, depth_model = depth_model, range_model = range_model, range_model2 =range_model2)
+            output = test(testdata_path, depth_model = depth_model, range_model = range_model, range_model2 =range_model2, activity_gate = activity_gate, processes = processes)
             
             # Speichere die Ausgabe
             output_filename = file_name.split('/')[-1].split('.')[0]
@@ -106,7 +106,7 @@ def test(testdata_path, depth_model = None, range_model = None,range_model2=None
             FalseNegtive.append(FN)
 
         else:
-            mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers =  detector.Forward(ira_img)
+            mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers, valid_ids =  detector.Forward(ira_img)
             
             # 🛑 KRITISCH: Sammeln der erkannten BBoxes für diesen Frame
             valid_BBoxes_in_frame = valid_BBoxes 
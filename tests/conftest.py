@@ -0,0 +1,30 @@
+import os
+import sys
+import pickle
+import functools
+import numpy as np
+
+# the modules of the repository are imported from its root, as the scripts do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the ambient temperature of the recordings in the Outputs folder, which only store the sensor frames
+AMBIENT_TEMPERATURE = 24.0
+
+
+@functools.lru_cache(maxsize=None)
+def LoadRecording(name, num_frames):
+    """the first sensor frames of a recording in the Outputs folder
+
+    Args:
+        name (str): the recording, e.g. "FiveUser_Dynamic_0_sensor_4"
+        num_frames (int): the number of frames
+
+    Returns:
+        numpy.array: the raw sensor frames (num_frames,24,32), one subpage of every frame is 0
+    """
+    with open(os.path.join(ROOT, 'Outputs', name + '.pkl'), 'rb') as f:
+        recording = pickle.load(f)
+    frames = np.array(recording['ira_matrix'][:num_frames], dtype=np.float64)
+    frames.setflags(write=False)
+    return frames
@@ -0,0 +1,190 @@
+import itertools
+import numpy as np
+import pytest
+from skimage import measure
+from skimage.filters import threshold_multiotsu
+
+import functions2
+
+from conftest import LoadRecording, AMBIENT_TEMPERATURE
+from functions2 import *
+
+
+# the row by row loop that DriftCuttingMask replaced, kept as the reference
+def CuttingEdageLoop(mask_frame, original_mask, threshold_x, stride, lambda_x):
+    Y_dim, X_dim = mask_frame.shape
+    mask_2 = np.ones_like(mask_frame)
+    for t in threshold_x:
+        t = int(t)
+        last_drift = 0
+        last_cut_pt = t
+        for row in range(Y_dim):
+            left_mean = np.mean(mask_frame[row, max(t-20, 0):t])
+            right_mean = np.mean(mask_frame[row, t:min(t + 20, X_dim)])
+            drift = lambda_x * (left_mean - right_mean) + (1-lambda_x) * last_drift
+            current_cut_pt = int(drift*stride + t)
+            if current_cut_pt < last_cut_pt:
+                mask_2[row, current_cut_pt:last_cut_pt+1] = 0
+            else:
+                mask_2[row, last_cut_pt: current_cut_pt+1] = 0
+            last_cut_pt = current_cut_pt
+            last_drift = drift
+    return mask_2 * original_mask
+
+
+# the between-class variance (up to constants) of the classes split after the threshold bins
+def BetweenClassVariance(hist, thresh_idx):
+    edges = [0] + [t + 1 for t in thresh_idx] + [len(hist)]
+    bins = np.arange(len(hist))
+    variance = 0.0
+    for start, stop in zip(edges[:-1], edges[1:]):
+        n = np.sum(hist[start:stop])
+        if n > 0:
+            variance += np.sum(hist[start:stop] * bins[start:stop])**2 / n
+    return variance
+
+
+def BBoxIoU(bbox1, bbox2):
+    x1, y1, w1, h1 = bbox1
+    x2, y2, w2, h2 = bbox2
+    w = max(min(x1 + w1, x2 + w2) - max(x1, x2), 0)
+    h = max(min(y1 + h1, y2 + h2) - max(y1, y2), 0)
+    return w * h / (w1 * h1 + w2 * h2 - w * h)
+
+
+def DetectorInputs(name, num_frames):
+    # the uint8 frames of the BaseProcess that the detection receives, the invalid frames are dropped
+    frames = LoadRecording(name, num_frames)
+    ira_img, _, _, valid = PrePipeline(20, 37).ForwardBatch(frames, np.full(len(frames), AMBIENT_TEMPERATURE))
+    return ira_img[valid]
+
+
+def test_connected_components_match_skimage():
+    rng = np.random.default_rng(0)
+    masks = [np.where(rng.random((60, 80)) > p, 255, 0).astype(np.uint8) for p in (0.3, 0.5, 0.7)]
+    detector = DetectingProcess(20, 5)
+    box_size = (20*20*5)//2*2 + 1
+    masks += [detector.AdaptiveBinary(frame, 255, box_size) for frame in DetectorInputs("FiveUser_Dynamic_0_sensor_4", 5)]
+    for mask in masks:
+        regions = ConnectedComponents(mask)
+        labels = measure.label(mask > 0, connectivity=2)
+        np.testing.assert_array_equal(regions.labels, labels)
+        properties = measure.regionprops(labels)
+        assert len(regions) == len(properties)
+        np.testing.assert_array_equal(regions.Areas(), [p.area for p in properties])
+        np.testing.assert_array_equal(regions.BBoxes(), [(p.bbox[1], p.bbox[0], p.bbox[3] - p.bbox[1], p.bbox[2] - p.bbox[0]) for p in properties])
+        # selecting regions keeps the labels of the others
+        kept = regions.TopK(3)
+        np.testing.assert_array_equal(kept.Mask(1), np.isin(labels, kept.ids).astype(np.uint8))
+
+
+@pytest.mark.parametrize("stride, lambda_x", [(0.4, 0.4), (0.8, 0.6)])
+def test_drift_cutting_matches_loop(stride, lambda_x):
+    detector = DetectingProcess(20, 5)
+    for frame in DetectorInputs("FourUser_Dynamic_0_sensor_4", 10):
+        regions, mask3 = detector.FindRegions(frame)
+        mask_frame = np.where(mask3>0.2, frame, 0).astype(frame.dtype)
+        W = frame.shape[1]
+        for i, (rows, columns, m) in enumerate(regions.Crops()):
+            # edges inside the region and beside the frame borders, the windows of the edges are cut by the borders
+            edges = [columns.start + 3, (columns.start + columns.stop) // 2, columns.stop - 1, 1, W - 2]
+            original_mask = regions.RegionMask(i)
+            expected = CuttingEdageLoop(mask_frame[rows], original_mask[rows], edges, stride, lambda_x)
+            np.testing.assert_array_equal(detector.CuttingEdage(mask_frame[rows], original_mask[rows], edges, stride, lambda_x), expected)
+            # a crop of the columns beside the edges gives the same cut
+            window = slice(max(columns.start - 20, 0), min(columns.stop + 20, W))
+            inner = edges[:3]
+            expected = CuttingEdageLoop(mask_frame[rows], original_mask[rows], inner, stride, lambda_x)[:, window]
+            cut = detector.CuttingEdage(mask_frame[rows, window], original_mask[rows, window], inner, stride, lambda_x, x_offset = window.start, width = W)
+            np.testing.assert_array_equal(cut, expected)
+
+
+def test_drift_cutting_large_drift():
+    # the drift moves the cut beyond the frame borders, where the loop sliced with negative and too large columns
+    rng = np.random.default_rng(1)
+    mask_frame = np.zeros((50, 60), np.uint8)
+    mask_frame[:, :30] = rng.integers(200, 256, (50, 30))
+    mask_frame[:, 30:] = rng.integers(0, 20, (50, 30))
+    original_mask = np.ones_like(mask_frame)
+    for stride, lambda_x in ((0.8, 0.6), (2.0, 0.9)):
+        for edges in ([30], [5, 30, 55], [25.7, 40.2]):
+            np.testing.assert_array_equal(DriftCuttingMask(mask_frame, edges, stride, lambda_x) * original_mask, CuttingEdageLoop(mask_frame, original_mask, edges, stride, lambda_x))
+
+
+def test_drift_cutting_empty_window():
+    mask_frame = np.full((10, 40), 100, np.uint8)
+    with pytest.raises(ValueError):
+        DriftCuttingMask(mask_frame, [0], 0.8, 0.6)
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_multi_otsu_matches_exhaustive_search(use_numba, monkeypatch):
+    if not use_numba:
+        monkeypatch.setattr(functions2, "nb", None)
+    rng = np.random.default_rng(2)
+    for trial in range(30):
+        hist = rng.random(16) * (rng.random(16) > 0.3)
+        hist[rng.integers(16)] += 1.0
+        bin_centers = np.arange(16, dtype=np.float64)
+        for classes in (2, 3, 4):
+            if np.count_nonzero(hist) < classes:
+                continue
+            thresholds = MultiOtsuThresholds(hist, bin_centers, classes)
+            assert len(thresholds) == classes - 1
+            best = max(BetweenClassVariance(hist, t) for t in itertools.combinations(range(15), classes - 1))
+            assert BetweenClassVariance(hist, thresholds.astype(int)) == pytest.approx(best, rel=1e-12)
+
+
+def test_multi_otsu_matches_skimage():
+    detector = DetectingProcess(20, 5)
+    for frame in DetectorInputs("FiveUser_Dynamic_0_sensor_4", 5):
+        regions, mask3 = detector.FindRegions(frame)
+        for rows, columns, m in regions.Crops():
+            distri_x, bins_x, _ = detector.TemperatureDistributionCalc(frame[rows, columns], m, columns.start, frame.shape[1])
+            for classes in (2, 3):
+                np.testing.assert_array_equal(detector.MultiOtsu((distri_x, bins_x), classes), threshold_multiotsu(hist=(distri_x, bins_x), classes=classes))
+    # the histogram with as many values as classes is split between them
+    np.testing.assert_array_equal(MultiOtsuThresholds(np.array([0, 3, 0, 1, 2, 0]), np.arange(6.0), 3), [1, 3])
+    with pytest.raises(ValueError):
+        MultiOtsuThresholds(np.array([0, 3, 0, 0]), np.arange(4.0), 2)
+
+
+@pytest.mark.parametrize("name", ["FiveUser_Dynamic_0_sensor_4", "FourUser_Dynamic_0_sensor_4", "Bathroom1_0_sensor_1"])
+def test_low_resolution_threshold_matches_full_resolution(name):
+    box_size = (20*20*5)//2*2 + 1
+    full = DetectingProcess(20, 5)
+    for frame in DetectorInputs(name, 10):
+        mask = full.AdaptiveBinary(frame, 255, box_size)
+        # at downscale 1 the threshold surface is the one of cv2.adaptiveThreshold
+        _, surface = full.ThresholdSurface(frame, box_size, 1)
+        np.testing.assert_array_equal(np.where(frame > np.rint(surface), 255, 0).astype(np.uint8), mask)
+        low_mask = DetectingProcess(20, 5, threshold_downscale=4).AdaptiveBinary(frame, 255, box_size)
+        assert low_mask.shape == mask.shape and low_mask.dtype == np.uint8
+        iou = np.count_nonzero(mask & low_mask) / np.count_nonzero(mask | low_mask)
+        assert iou >= 0.999
+
+
+@pytest.mark.parametrize("name", ["FiveUser_Dynamic_0_sensor_4", "Bathroom1_0_sensor_1"])
+def test_coarse_to_fine_at_full_resolution_matches_single_resolution(name):
+    # at the full expansion ratio the coarse regions are the regions, and the windows hold them whole
+    single = DetectingProcess(20, 5)
+    coarse = DetectingProcess(20, 5, coarse_expansion_coefficient=20)
+    for frame in DetectorInputs(name, 10):
+        mask3, re_mask, _, bboxes = single.Forward(frame)
+        coarse_mask3, coarse_re_mask, _, coarse_bboxes = coarse.Forward(frame)
+        np.testing.assert_array_equal(coarse_mask3, mask3)
+        np.testing.assert_array_equal(coarse_re_mask, re_mask)
+        assert coarse_bboxes == bboxes
+
+
+def test_coarse_to_fine_bboxes_agree():
+    # the coarse regions can merge or drop small users, so the agreement is measured on the bboxes on average
+    # (1.0 and 0.96 for these recordings with coarse_expansion_coefficient 4)
+    single = DetectingProcess(20, 5)
+    coarse = DetectingProcess(20, 5, coarse_expansion_coefficient=4)
+    for name in ("FourUser_Dynamic_0_sensor_4", "FiveUser_Dynamic_0_sensor_4"):
+        ious = []
+        for frame in DetectorInputs(name, 10):
+            coarse_bboxes = coarse.Forward(frame)[3]
+            ious += [max([BBoxIoU(bbox, coarse_bbox) for coarse_bbox in coarse_bboxes], default=0.0) for bbox in single.Forward(frame)[3]]
+        assert len(ious) > 0 and np.mean(ious) >= 0.9
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from conftest import LoadRecording, AMBIENT_TEMPERATURE
+from functions2 import *
+
+
+POOLINGS = [((200, 400), 100, 100), ((64, 48), 8, 4), ((30, 30), 7, 5)]
+
+
+def RecordingROIs(name, num_frames, dtype = TEMPERATURE_DTYPE):
+    # temperature crops of different shapes, at the borders of the frame as well
+    frames = LoadRecording(name, num_frames)
+    _, _, ira_mat, valid = PrePipeline(20, 37, dtype=dtype).ForwardBatch(frames, np.full(len(frames), AMBIENT_TEMPERATURE))
+    rois = []
+    for index in np.flatnonzero(valid):
+        for x, y, w, h in ((300, 150, 80, 200), (0, 0, 45, 33), (600, 300, 40, 180), (10, 470, 3, 10)):
+            rois.append(np.array(ira_mat[index][y:y+h, x:x+w]))
+    return rois
+
+
+# the maxima of the grid of proportional blocks, one block at a time
+def BlockMax(roi, grid):
+    H, W = roi.shape
+    row_bounds = np.arange(grid[0] + 1) * H // grid[0] if H >= grid[0] else np.append(np.arange(grid[0]) * H // grid[0], -1)
+    column_bounds = np.arange(grid[1] + 1) * W // grid[1] if W >= grid[1] else np.append(np.arange(grid[1]) * W // grid[1], -1)
+    pooled = np.empty(grid, roi.dtype)
+    for i in range(grid[0]):
+        rows = slice(row_bounds[i], row_bounds[i+1]) if H >= grid[0] else slice(row_bounds[i], row_bounds[i] + 1)
+        for j in range(grid[1]):
+            columns = slice(column_bounds[j], column_bounds[j+1]) if W >= grid[1] else slice(column_bounds[j], column_bounds[j] + 1)
+            pooled[i, j] = roi[rows, columns].max()
+    return pooled
+
+
+@pytest.mark.parametrize("resize_shape, window_size, stride", POOLINGS)
+def test_pooling_numpy_matches_torch(resize_shape, window_size, stride):
+    pytest.importorskip("torch")
+    rng = np.random.default_rng(0)
+    rois = RecordingROIs("FiveUser_Dynamic_0_sensor_4", 5) + [rng.random((57, 23)).astype(np.float32), rng.random((120, 90))]
+    roipooling = ROIPooling(resize_shape, window_size, stride)
+    torch_roipooling = ROIPooling(resize_shape, window_size, stride, backend="torch")
+    for roi in rois:
+        pooled = roipooling.Pooling(roi)
+        assert pooled.shape == roipooling.grid
+        np.testing.assert_array_equal(pooled, torch_roipooling.Pooling(roi))
+
+
+@pytest.mark.parametrize("resize_shape, window_size, stride", POOLINGS)
+def test_pooling_batch_matches_pooling(resize_shape, window_size, stride):
+    rng = np.random.default_rng(1)
+    roipooling = ROIPooling(resize_shape, window_size, stride)
+    rois = RecordingROIs("FourUser_Dynamic_0_sensor_4", 5)
+    for batch in (rois, rois[:1], rois[:3] + [rng.random((40, 20))]):
+        # a float64 ROI among the float32 ones makes the whole stack float64
+        np.testing.assert_array_equal(roipooling.PoolingBatch(batch), np.stack([roipooling.PoolingNumpy(roi) for roi in batch]))
+    for backend in ("reduceat", "torch"):
+        if backend == "torch":
+            pytest.importorskip("torch")
+        other = ROIPooling(resize_shape, window_size, stride, backend=backend)
+        np.testing.assert_array_equal(other.PoolingBatch(rois), np.stack([other.Pooling(roi) for roi in rois]))
+
+
+def test_pooling_reduceat_matches_block_max():
+    rng = np.random.default_rng(2)
+    roipooling = ROIPooling((200, 400), 100, 100, backend="reduceat")
+    assert roipooling.grid == (4, 2)
+    for roi in RecordingROIs("Bathroom1_0_sensor_1", 5) + [rng.random((2, 9)), rng.random((9, 1)), rng.random((1, 1))]:
+        np.testing.assert_array_equal(roipooling.Pooling(roi), BlockMax(roi, roipooling.grid))
+    # the rows shorter than the grid are repeated, the columns are split in halves
+    roi = np.tile(np.arange(50.0), (3, 1)) + np.arange(3.0)[:, None] * 100
+    np.testing.assert_array_equal(roipooling.Pooling(roi), [[24, 49], [24, 49], [124, 149], [224, 249]])
+    # the blocks of the pixels are close to the windows of the resized ROI, the maxima differ by hundredths of a degree
+    for roi in RecordingROIs("Bathroom1_0_sensor_1", 5, np.float64):
+        np.testing.assert_allclose(roipooling.Pooling(roi), ROIPooling((200, 400), 100, 100).Pooling(roi), rtol=0, atol=0.1)
+
+
+def test_feature_extractor_matches_single_roi_features():
+    frames = LoadRecording("FourUser_Dynamic_0_sensor_4", 5)
+    _, _, ira_mat, valid = PrePipeline(20, 37).ForwardBatch(frames, np.full(len(frames), AMBIENT_TEMPERATURE))
+    stack = np.array(ira_mat)[valid]
+    roipooling = ROIPooling((200, 400), 100, 100)
+    feature_extractor = FeatureExtractor(roipooling, topk=8)
+    # the topk is limited to the 4x2 pooled maxima
+    assert FeatureExtractor(roipooling, topk=20).topk == 8
+    bboxes = [(300, 150, 80, 200), (0, 0, 45, 33), (100, 100, 0, 50), (600.0, 300.0, 40.0, 180.0)]
+    frame_indices = [0, 1, 2, len(stack) - 1]
+    features = feature_extractor.Forward(stack, bboxes, frame_indices)
+    assert features.shape == (4, 10)
+    for row, (x, y, w, h), index in zip(features, bboxes, frame_indices):
+        if w == 0:
+            # an empty ROI gives a row of NaN
+            assert np.all(np.isnan(row))
+            continue
+        pooled = roipooling.PoolingNumpy(stack[index][int(y):int(y+h), int(x):int(x+w)])
+        np.testing.assert_array_equal(row[:8], np.sort(pooled.flatten())[::-1])
+        np.testing.assert_array_equal(row[8:], [x + w / 2, y + h / 2])
+    # one frame and the TemperatureMatrix windows give the same features
+    expected = feature_extractor.Forward(stack, bboxes, [0] * len(bboxes))
+    np.testing.assert_array_equal(feature_extractor.Forward(stack[0], bboxes), expected)
+    np.testing.assert_array_equal(feature_extractor.Forward(ira_mat[0], bboxes), expected)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from conftest import LoadRecording, AMBIENT_TEMPERATURE
+from functions2 import *
+
+
+# the per-pixel loops that SubpageInterpolating and Outlier2TypeElimilate replaced, kept as the references. A -1 index
+# wraps around to the opposite edge and a +1 index beyond the border raises an IndexError, which drops the neighbour.
+def SubpageInterpolatingLoop(subpage):
+    shape = subpage.shape
+    mat = subpage.copy()
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            if mat[i,j] > 0.0:
+                continue
+            values = []
+            for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                try:
+                    values.append(mat[i+di,j+dj])
+                except IndexError:
+                    pass
+            mat[i,j] = sum(values)/len(values)
+    return mat
+
+def Outlier2TypeElimilateLoop(mat):
+    mat_copy = mat.copy()
+    for i, j in zip(*np.where(mat>300)):
+        values = []
+        for di, dj in ((-1, -1), (1, -1), (-1, 1), (1, 1)):
+            try:
+                values.append(mat_copy[i+di,j+dj])
+            except IndexError:
+                pass
+        mat_copy[i,j] = sum(values)/len(values)
+    return mat_copy
+
+
+def test_subpage_interpolating_matches_loop():
+    frames = LoadRecording("FiveUser_Dynamic_0_sensor_4", 50)
+    for frame in frames:
+        np.testing.assert_array_equal(SubpageInterpolating(frame), SubpageInterpolatingLoop(frame))
+    # a stack of frames is interpolated frame by frame
+    np.testing.assert_array_equal(SubpageInterpolating(frames), np.stack([SubpageInterpolatingLoop(frame) for frame in frames]))
+
+
+@pytest.mark.parametrize("outliers", [[(0, 0)], [(23, 31)], [(0, 31)], [(23, 0)], [(0, 6), (11, 0), (23, 20), (15, 31), (12, 12)]])
+def test_outlier_repair_matches_loop(outliers):
+    # isolated outliers, at the corners and the borders of the frame as well
+    chessboard, _ = GetChessboard((24, 32))
+    preprocessor = Preprocess(chessboard)
+    for frame in LoadRecording("Bathroom1_0_sensor_1", 20):
+        frame = SubpageInterpolating(frame)
+        for i, j in outliers:
+            frame[i, j] = 400
+        repaired, stats = preprocessor.Outlier2TypeElimilate(frame)
+        np.testing.assert_array_equal(repaired, Outlier2TypeElimilateLoop(frame))
+        assert stats == 2
+
+
+def test_forward_batch_matches_forward():
+    frames = np.array(LoadRecording("FiveUser_Dynamic_0_sensor_4", 30))
+    frames[7] = 400  # an invalid frame, both subpages are out of range
+    ambient = np.full(len(frames), AMBIENT_TEMPERATURE)
+    ira_img_batch, subpage_type_batch, ira_mat_batch, valid = PrePipeline(20, 37).ForwardBatch(frames, ambient)
+    prepipeline = PrePipeline(20, 37)
+    for index, frame in enumerate(frames):
+        ira_img, subpage_type, ira_mat = prepipeline.Forward(frame, AMBIENT_TEMPERATURE)
+        assert valid[index] == isinstance(ira_img, np.ndarray)
+        if not valid[index]:
+            assert not np.any(ira_img_batch[index])
+            continue
+        np.testing.assert_array_equal(ira_img_batch[index], ira_img)
+        assert subpage_type_batch[index] == subpage_type
+        np.testing.assert_array_equal(np.array(ira_mat_batch[index]), np.array(ira_mat))
+
+
+def test_temperature_matrix_matches_resize():
+    frames = SubpageInterpolating(LoadRecording("FiveUser_Dynamic_0_sensor_4", 10))
+    basic_process = BaseProcess(20, 37)
+    bandpass_frames = basic_process.BandPass(frames, np.full(len(frames), AMBIENT_TEMPERATURE))
+    ira_mat = TemperatureMatrix(bandpass_frames, 20)
+    assert ira_mat.shape == (10, 480, 640)
+    for index, bandpass_frame in enumerate(bandpass_frames):
+        full = cv2.resize(bandpass_frame, (640, 480), interpolation=cv2.INTER_LINEAR)
+        np.testing.assert_allclose(np.array(ira_mat[index]), full, rtol=0, atol=1e-9)
+        # windows inside the frame and at its borders
+        for y, x, h, w in ((0, 0, 37, 53), (100, 250, 211, 90), (400, 600, 80, 40), (479, 0, 1, 640)):
+            np.testing.assert_allclose(ira_mat[index][y:y+h, x:x+w], full[y:y+h, x:x+w], rtol=0, atol=1e-9)
+
+
+def test_float32_pipeline_matches_float64():
+    frames = LoadRecording("FourUser_Dynamic_0_sensor_4", 20)
+    ambient = np.full(len(frames), AMBIENT_TEMPERATURE)
+    ira_img32, _, ira_mat32, valid = PrePipeline(20, 37).ForwardBatch(frames, ambient)
+    ira_img64, _, ira_mat64, _ = PrePipeline(20, 37, dtype=np.float64).ForwardBatch(frames, ambient)
+    assert ira_img32.dtype == np.uint8 and ira_mat32.dtype == np.float32
+    np.testing.assert_array_equal(ira_img32, ira_img64)
+    np.testing.assert_allclose(np.array(ira_mat32), np.array(ira_mat64), rtol=0, atol=1e-5)
+    detector32 = TrackingDetectingMergeProcess(20, 5, lean=True)
+    detector64 = TrackingDetectingMergeProcess(20, 5, lean=True)
+    for index in np.flatnonzero(valid):
+        result32 = detector32.Forward(ira_img32[index], ira_mat32[index])
+        result64 = detector64.Forward(ira_img64[index], ira_mat64[index])
+        assert [tuple(map(int, bbox)) for bbox in result32.valid_BBoxes] == [tuple(map(int, bbox)) for bbox in result64.valid_BBoxes]
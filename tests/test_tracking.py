@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from conftest import LoadRecording, AMBIENT_TEMPERATURE
+from functions2 import *
+
+
+def BBoxIoU(bbox1, bbox2):
+    x1, y1, w1, h1 = bbox1
+    x2, y2, w2, h2 = bbox2
+    w = max(min(x1 + w1, x2 + w2) - max(x1, x2), 0)
+    h = max(min(y1 + h1, y2 + h2) - max(y1, y2), 0)
+    union = w1 * h1 + w2 * h2 - w * h
+    return w * h / union if union > 0 else 0.0
+
+
+def test_bbox_iou_matrix_matches_pairwise():
+    rng = np.random.default_rng(0)
+    bboxes1 = np.column_stack([rng.integers(0, 600, 12), rng.integers(0, 440, 12), rng.integers(0, 120, 12), rng.integers(0, 120, 12)])
+    bboxes2 = np.column_stack([rng.integers(0, 600, 7), rng.integers(0, 440, 7), rng.integers(0, 120, 7), rng.integers(0, 120, 7)])
+    bboxes2[0] = bboxes1[0]
+    bboxes2[1] = (0, 0, 0, 0)
+    iou = BBoxIoUMatrix(bboxes1, bboxes2)
+    assert iou.shape == (12, 7)
+    expected = [[BBoxIoU(bbox1, bbox2) for bbox2 in bboxes2] for bbox1 in bboxes1]
+    np.testing.assert_allclose(iou, expected, rtol=1e-12, atol=0)
+    assert BBoxIoUMatrix(bboxes1, []).shape == (12, 0)
+
+
+@pytest.mark.parametrize("velocity", [(0, 0), (6, 2), (-8, 0)])
+def test_bbox_tracker_follows_moving_bbox(velocity):
+    frame = np.zeros((480, 640), np.uint8)
+    tracker = BBoxTrackingProcess(max_coast_frames = 3)
+    bbox = np.array([300, 200, 60, 120])
+    tracker.CreatTracker(frame, tuple(bbox))
+    # a second user far away that stays still
+    tracker.CreatTracker(frame, (20, 300, 50, 100))
+    for t in range(30):
+        bbox[:2] += velocity
+        states, bboxes, timers = tracker.Forward(frame, [(20, 300, 50, 100), tuple(bbox)])
+        assert states == [True, True] and timers == [t + 1, t + 1]
+    assert BBoxIoU(bboxes[0], bbox) > 0.9 and BBoxIoU(bboxes[1], (20, 300, 50, 100)) > 0.9
+    # without detections the tracks coast for max_coast_frames frames before they are lost
+    for t in range(4):
+        states, bboxes, _ = tracker.Forward(frame, [])
+        assert states == [t < 3, t < 3]
+    tracker.Close()
+
+
+def RecordingInputs(name, num_frames):
+    frames = LoadRecording(name, num_frames)
+    ira_img, _, ira_mat, valid = PrePipeline(20, 37).ForwardBatch(frames, np.full(len(frames), AMBIENT_TEMPERATURE))
+    return ira_img[valid], np.array(ira_mat)[valid]
+
+
+@pytest.mark.parametrize("tracker", [TrackingProcess, BBoxTrackingProcess])
+def test_track_ids_survive_deletion(tracker):
+    tracker = tracker()
+    frame = cv2.applyColorMap(np.tile(np.arange(640, dtype=np.uint8), (480, 1)), cv2.COLORMAP_JET)
+    ids = [tracker.CreatTracker(frame, (100 * i + 20, 100, 60, 120)) for i in range(3)]
+    assert ids == [0, 1, 2]
+    tracker.DeleteTracker(1)
+    assert tracker.ids == [0, 2]
+    # a replaced tracker keeps its id, a new one never reuses a deleted id
+    tracker.ReplaceTracker(0, frame, (30, 100, 60, 120))
+    assert tracker.CreatTracker(frame, (400, 100, 60, 120)) == 3
+    assert tracker.ids == [0, 2, 3]
+    tracker.Close()
+
+
+def test_track_registry_matches_outputs():
+    merger = TrackingDetectingMergeProcess(20, 5, lean=True)
+    created = 0
+    for frame_gray, ira_mat in zip(*RecordingInputs("FourUser_Dynamic_0_sensor_4", 30)):
+        result = merger.Forward(frame_gray, ira_mat)
+        assert len(set(result.valid_ids)) == len(result.valid_ids)
+        assert all(track_id < merger.tracker.next_id for track_id in result.valid_ids)
+        assert set(merger.tracker.ids) >= set(result.valid_ids)
+        for bbox, timer, track_id in zip(result.valid_BBoxes, result.valid_timers, result.valid_ids):
+            assert merger.GetTrack(track_id) == (bbox, timer)
+            assert merger.GetTrackAt((bbox[1] + bbox[3] / 2, bbox[0] + bbox[2] / 2)) is not None
+        created = max(created, merger.tracker.next_id)
+    # the users are followed over the frames instead of being created again on every frame
+    assert 0 < created < 30
+    merger.Close()
+
+
+def test_threaded_trackers_match_serial():
+    ira_img, ira_mat = RecordingInputs("FiveUser_Dynamic_0_sensor_4", 20)
+    serial = TrackingDetectingMergeProcess(20, 5, lean=True)
+    with TrackingDetectingMergeProcess(20, 5, tracker_threads=2, lean=True) as threaded:
+        executor = threaded.tracker.executor
+        assert executor is not None
+        for frame_gray, mat in zip(ira_img, ira_mat):
+            result = serial.Forward(frame_gray, mat)
+            threaded_result = threaded.Forward(frame_gray, mat)
+            assert threaded_result == result
+    # leaving the context shuts the threads down
+    assert threaded.tracker.executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(len, [])
+    serial.Close()
+    # closing twice and closing the serial trackers are harmless
+    threaded.Close()
+    tracker = TrackingProcess(threads=1)
+    assert tracker.executor is None
+    tracker.Close()
@@ -63,7 +63,8 @@ temperature_upper_bound = 37
 valid_region_area_limit = 5
 ROIevaluationThreshold = 0.5
 prepipeline = PrePipeline(expansion_coefficient, temperature_upper_bound)
-detector = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit)
+preprocess_batch_size = 128 # number of frames preprocessed together by prepipeline.ForwardBatch
+detector = TrackingDetectingMergeProcess(expansion_coefficient, valid_region_area_limit, lean=True)
 
 # estimator configuration
 Roi_Pooling_Size = (2,4)
@@ -75,6 +76,7 @@ topk = 8
 if topk > Roi_Pooling_Size[0] * Roi_Pooling_Size[1]:
     topk = Roi_Pooling_Size[0] * Roi_Pooling_Size[1]
 topk = Roi_Pooling_Size[0] * Roi_Pooling_Size[1]
+feature_extractor = FeatureExtractor(roipooling, topk)
 
 
 ####################################################################################################
@@ -100,11 +102,17 @@ if not reuse_train_roi:
     ROI_range_label = []
 
     for index in tqdm(range(trainset.len())):
+        if index % preprocess_batch_size == 0:
+            # the stateless preprocessing runs for a whole batch of frames at once
+            ira_matrix_batch, ambient_temperature_batch = trainset.GetBatch(index, index + preprocess_batch_size)
+            ira_img_batch, subpage_type_batch, ira_mat_batch, valid_batch = prepipeline.ForwardBatch(ira_matrix_batch, ambient_temperature_batch)
         ira_matrix, ambient_temperature, timestamps, GT_bbox, GT_depth, GT_range = trainset.GetSample(index)
-        ira_img, subpage_type, ira_mat = prepipeline.Forward(ira_matrix, ambient_temperature)
-        if not isinstance(ira_img, (np.ndarray)):
+        if not valid_batch[index % preprocess_batch_size]:
             continue
-        mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers =  detector.Forward(ira_img)
+        ira_img = ira_img_batch[index % preprocess_batch_size]
+        ira_mat = ira_mat_batch[index % preprocess_batch_size]
+        tracking_result = detector.Forward(ira_img)
+        valid_BBoxes, valid_timers = tracking_result.valid_BBoxes, tracking_result.valid_timers
         result, matched_bbox = ROIDetectionEvaluation(GT_bbox, valid_BBoxes,valid_timers, threshold=ROIevaluationThreshold)
         TP, FP, FN =  result
         TruePositive.append(TP)
@@ -156,22 +164,10 @@ else:
     
 
 # Stage 2: Depth and Range Estimation models training
-preprocessed_roi = []
-bbox_centerpoints = []
-for index,roi in enumerate(ROI):
-    preprocessed_roi.append(roipooling.PoolingNumpy(roi))  # roi pooling
-    x,y,w,h = ROI_bbox[index]
-    bbox_centerpoints.append([x+w/2, y+h/2])
-    
-sorted_roi = np.stack(preprocessed_roi) # stack
-sorted_roi = np.reshape(sorted_roi, (sorted_roi.shape[0], -1)) # flatten
-sorted_roi = np.sort(sorted_roi, axis=-1)[:,::-1] # sort
-bbox_centerpoints = np.array(bbox_centerpoints) # get center points
+depth_estimation_input = feature_extractor.FromROIs(ROI, ROI_bbox) # the sorted pooled roi and the centerpoints
+sorted_roi = depth_estimation_input[:,:topk]
 range_label = np.array(ROI_range_label) # get label
 depth_label = np.array(ROI_depth_label) # get label
-# concatenate the centerpoints and the sorted roi
-# depth_estimation_input = np.concatenate((sorted_roi, bbox_centerpoints), axis=1)
-depth_estimation_input = np.concatenate((sorted_roi[:,:topk],bbox_centerpoints),axis=1)
 
 range_estimator = Estimator(model_name=Model_Name, ensemble=1, topk=topk)
 range_model_score = range_estimator.Training(sorted_roi, range_label)
@@ -208,11 +204,17 @@ if not reuse_validation_roi:
     ROI_range_label = []
 
     for index in tqdm(range(validationset.len())):
+        if index % preprocess_batch_size == 0:
+            # the stateless preprocessing runs for a whole batch of frames at once
+            ira_matrix_batch, ambient_temperature_batch = validationset.GetBatch(index, index + preprocess_batch_size)
+            ira_img_batch, subpage_type_batch, ira_mat_batch, valid_batch = prepipeline.ForwardBatch(ira_matrix_batch, ambient_temperature_batch)
         ira_matrix, ambient_temperature, timestamps, GT_bbox, GT_depth, GT_range = validationset.GetSample(index)
-        ira_img, subpage_type, ira_mat = prepipeline.Forward(ira_matrix, ambient_temperature)
-        if not isinstance(ira_img, (np.ndarray)):
+        if not valid_batch[index % preprocess_batch_size]:
             continue
-        mask, x_split_mask_colored, filtered_mask_colored, prvs_mask_colored, original_BBoxes,original_timers, valid_BBoxes, valid_timers =  detector.Forward(ira_img)
+        ira_img = ira_img_batch[index % preprocess_batch_size]
+        ira_mat = ira_mat_batch[index % preprocess_batch_size]
+        tracking_result = detector.Forward(ira_img)
+        valid_BBoxes, valid_timers = tracking_result.valid_BBoxes, tracking_result.valid_timers
         result, matched_bbox = ROIDetectionEvaluation(GT_bbox, valid_BBoxes,valid_timers, threshold=ROIevaluationThreshold)
         TP, FP, FN =  result
         TruePositive.append(TP)
@@ -273,22 +275,10 @@ else:
     
 
 # Stage 2: Depth and Range Estimation models validation
-preprocessed_roi = []
-bbox_centerpoints = []
-for index,roi in enumerate(ROI):
-    preprocessed_roi.append(roipooling.PoolingNumpy(roi))  # roi pooling
-    x,y,w,h = ROI_bbox[index]
-    bbox_centerpoints.append([x+w/2, y+h/2])
-    
-sorted_roi = np.stack(preprocessed_roi) # stack
-sorted_roi = np.reshape(sorted_roi, (sorted_roi.shape[0], -1)) # flatten
-sorted_roi = np.sort(sorted_roi, axis=-1)[:,::-1] # sort
-bbox_centerpoints = np.array(bbox_centerpoints) # get center points
+depth_estimation_input = feature_extractor.FromROIs(ROI, ROI_bbox) # the sorted pooled roi and the centerpoints
+sorted_roi = depth_estimation_input[:,:topk]
 range_label = np.array(ROI_range_label) # get label
 depth_label = np.array(ROI_depth_label) # get label
-# concatenate the centerpoints and the sorted roi
-# depth_estimation_input = np.concatenate((sorted_roi, bbox_centerpoints), axis=1)
-depth_estimation_input = np.concatenate((sorted_roi[:,:topk],bbox_centerpoints),axis=1)
 
 predict_range = range_estimator.Testing(sorted_roi)
 range_prediction = predict_range[0]